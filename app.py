@@ -20,6 +20,7 @@ def main():
     # ロジック接続
     logic = AppLogic(window, db_path="data/kabus_trade.db")
     logic.bind()
+    app.aboutToQuit.connect(logic.shutdown)
     app.aboutToQuit.connect(app_lock.unlock)
 
     window.show()
@@ -1,20 +1,454 @@
 # logic.py
 from __future__ import annotations
 
+import http.client
+import io
 import json
+import os
+import queue
+import random
 import time
 import sqlite3
+import threading
 import urllib.error
 import urllib.parse
-import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from dataclasses import dataclass
-from datetime import datetime, time as dt_time
-from typing import Optional
+from datetime import datetime, time as dt_time, timedelta
+from functools import cached_property
+from typing import Iterator, Optional
 
-from PySide6.QtCore import QObject, QTimer
+try:
+    import orjson
+except ImportError:  # 任意依存。無ければ標準のjsonで処理する
+    orjson = None
+
+import shiboken6
+from PySide6.QtCore import QObject, QRunnable, Qt, QThread, QThreadPool, QTimer, Signal
 
 from ui_main import MainWindow
 
+_STATE_TO_STATUS = {
+    "1": "WORKING",
+    "2": "WORKING",
+    "3": "PARTIAL",
+    "4": "PARTIAL",
+    "5": "FILLED",
+    "6": "CANCELLED",
+    "7": "CANCELLED",
+}
+_ORDER_ID_KEYS = ("ID", "OrderId", "OrderID")
+_PRICE_KEYS = ("RecPrice", "ExecutionPrice", "Price")
+_QTY_KEYS = ("RecQty", "ExecutionQty", "Qty")
+# 発注エラー・DEBUGログに残すペイロードの項目
+_PAYLOAD_CONTEXT_KEYS = (
+    "Symbol", "Exchange", "Side", "Qty", "CashMargin", "DelivType",
+    "FundType", "MarginTradeType", "FrontOrderType", "Price",
+)
+_CASH_ENTRY = {"CashMargin": 1, "DelivType": 2, "FundType": "AA"}
+_MARGIN_ENTRY = {"CashMargin": 2, "MarginTradeType": 3, "DelivType": 0}
+# 売買区分の相互変換。kabuステーションは 1=売 / 2=買
+_SIDE_TO_KABU = {"buy": "2", "sell": "1"}
+_KABU_SIDE_TO_INTERNAL = {"1": "sell", "2": "buy"}
+_VALID_EXCHANGES = frozenset((1, 3, 5, 6, 9, 27))
+# 4001005（市場指定の誤り）で発注を弾かれたとき、次に試す市場の順番
+_RETRY_EXCHANGES = {1: (9, 27), 9: (27, 1), 27: (9, 1)}
+_DEFAULT_RETRY_EXCHANGES = (1, 9, 27)
+_YEN_FMT = "{:,.0f}円".format
+_REFRESH_EMA_ALPHA = 0.2
+_REFRESH_SLOW_SECONDS = 0.2
+_REFRESH_BACKOFF_SECONDS = 3.0
+# 監視画面の表示分類。そのまま表示する注文状態
+_KNOWN_ORDER_STATUSES_SQL = "'NEW','WORKING','PARTIAL','FILLED','CANCELLED','ERROR','UNKNOWN','WAITING'"
+# 監視画面に並べるカードの上限（新しく更新された順）
+_EXEC_STATUS_CARD_LIMIT = 200
+_TOKEN_SUFFIX = "/token"
+_TOKEN_SUFFIX_LEN = len(_TOKEN_SUFFIX)
+# 銘柄情報の照会で試す市場コード（東証, 名証, 福証, 札証, SOR）
+_SYMBOL_EXCHANGES = (1, 3, 5, 6, 9)
+# この時刻以降にEODの強制決済を行う
+_EOD_CUTOFF = dt_time(14, 30)
+# 前場・後場の取引時間（HHMMSS の整数で比較する）
+_AM_OPEN_HMS, _AM_CLOSE_HMS = 90000, 113000
+_PM_OPEN_HMS, _PM_CLOSE_HMS = 123000, 153000
+# 取引時間外でも、この秒数以内に予約時刻が来るジョブがあれば監視ループを回す
+_IDLE_SCHEDULE_LOOKAHEAD = timedelta(seconds=60)
+# kabuステーションの発注APIは秒間リクエスト数に上限があるため、並行数は控えめにする
+_ORDER_API_MAX_WORKERS = 4
+# 発注ペイロードのDEBUGログ。KABUS_PAYLOAD_DEBUG=0 で記録を止める
+_PAYLOAD_DEBUG_ENABLED = os.environ.get("KABUS_PAYLOAD_DEBUG", "1") != "0"
+# 使い回すSQLite接続の上限。監視ループ・UI操作・ログ書き込みスレッドで足りる本数
+_DB_POOL_SIZE = 4
+# /token取得に失敗した後、再試行を控える秒数
+_TOKEN_NEGATIVE_TTL_SECONDS = 5.0
+_DB_RETRY_COUNT = 5
+_DB_RETRY_BASE_SECONDS = 0.05
+_DB_RETRY_CAP_SECONDS = 1.0
+# 起動したまま運用し続けても統計が古びないよう、監視ループからこの間隔で PRAGMA optimize を流す
+_DB_OPTIMIZE_INTERVAL_SECONDS = 4 * 60 * 60
+_WRITE_QUEUE_MAXSIZE = 2048
+_WRITE_BATCH_SIZE = 256
+_WRITE_LINGER_SECONDS = 0.5
+
+# 接続を開いたときに一度だけ適用する設定。プールで使い回すため毎回の取得では実行しない
+_CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode = WAL;",
+    "PRAGMA busy_timeout = 30000;",
+    "PRAGMA foreign_keys = ON;",
+    "PRAGMA synchronous = NORMAL;",
+    "PRAGMA cache_size = -64000;",
+    "PRAGMA temp_store = MEMORY;",
+    "PRAGMA mmap_size = 268435456;",
+    # 自動チェックポイントを監視周期に当てにくくするため間隔を広げ、発注登録の直後に明示的に行う
+    "PRAGMA wal_autocheckpoint = 2000;",
+)
+
+# SQL側でJST現在時刻を得る式。_now_jst() と同じ書式になる
+_NOW_JST_SQL = "datetime('now','+9 hours')"
+
+_SQL_INSERT_EVENT_LOG = "INSERT INTO event_logs (batch_job_id, level, event_type, message) VALUES (?, ?, ?, ?)"
+_SQL_INSERT_EVENT_LOG_AT = "INSERT INTO event_logs (batch_job_id, level, event_type, message, created_at) VALUES (?, ?, ?, ?, ?)"
+
+_BATCH_ITEM_ADDED_COLUMNS = (
+    ("entry_order_id", "entry_order_id TEXT"),
+    ("tp_order_id", "tp_order_id TEXT"),
+    ("sl_order_id", "sl_order_id TEXT"),
+    ("eod_order_id", "eod_order_id TEXT"),
+    ("entry_filled_qty", "entry_filled_qty INTEGER NOT NULL DEFAULT 0"),
+    ("entry_avg_price", "entry_avg_price REAL"),
+    ("closed_qty", "closed_qty INTEGER NOT NULL DEFAULT 0"),
+    ("hold_id", "hold_id TEXT"),
+)
+
+_SCHEMA_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_batch_items_status_job ON batch_items(status, batch_job_id)",
+    # 予約キャンセル後の残件数や batch_jobs 起点の JOIN は batch_job_id 先頭で引く
+    "CREATE INDEX IF NOT EXISTS idx_batch_items_job_status ON batch_items(batch_job_id, status)",
+    "CREATE INDEX IF NOT EXISTS idx_batch_items_tp_order ON batch_items(tp_order_id) WHERE tp_order_id IS NOT NULL",
+    "CREATE INDEX IF NOT EXISTS idx_batch_items_sl_order ON batch_items(sl_order_id) WHERE sl_order_id IS NOT NULL",
+    "CREATE INDEX IF NOT EXISTS idx_batch_items_eod_order ON batch_items(eod_order_id) WHERE eod_order_id IS NOT NULL",
+    # 監視画面は未決済の明細だけを更新の新しい順に読むので、その順序のまま辿れるようにする
+    "CREATE INDEX IF NOT EXISTS idx_batch_items_open_updated ON batch_items(updated_at DESC, id DESC) WHERE status != 'CLOSED'",
+    # 予約の発火判定は status → run_mode → scheduled_at の順に絞るので、単独の status 索引から置き換える
+    "DROP INDEX IF EXISTS idx_batch_jobs_status",
+    "CREATE INDEX IF NOT EXISTS idx_batch_jobs_status_sched ON batch_jobs(status, run_mode, scheduled_at)",
+    "CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status, api_order_id)",
+    # 外部キー列。明細・ジョブ単位で注文や履歴をたどるときに全件走査しない
+    "CREATE INDEX IF NOT EXISTS idx_orders_batch_item ON orders(batch_item_id)",
+    "CREATE INDEX IF NOT EXISTS idx_event_logs_batch_job ON event_logs(batch_job_id)",
+    "CREATE INDEX IF NOT EXISTS idx_api_accounts_active ON api_accounts(is_active, id DESC)",
+)
+
+def _sql_order_status_label(column: str, fallback: str) -> str:
+    # _refresh_execution_status 用。空なら fallback、既知の状態はそのまま、それ以外は UNKNOWN
+    return (
+        f"CASE WHEN COALESCE({column}, '') = '' THEN '{fallback}'"
+        f" WHEN UPPER(TRIM({column})) IN ({_KNOWN_ORDER_STATUSES_SQL}) THEN UPPER(TRIM({column}))"
+        " ELSE 'UNKNOWN' END"
+    )
+
+
+# 監視ループで毎tick実行するSQLは同一の文字列オブジェクトで渡し、sqlite3のステートメントキャッシュに載せる
+_SQL_EXEC_STATUS = f"""
+SELECT bi.id,
+       bi.symbol,
+       bi.side,
+       bi.qty,
+       bi.status AS item_status,
+       bi.last_error,
+       bi.entry_filled_qty,
+       bi.closed_qty,
+       bi.status IN ('ENTRY_PARTIAL', 'ENTRY_FILLED', 'ENTRY_FILLED_WAIT_PRICE', 'BRACKET_SENT', 'EOD_MARKET_SENT') AS can_manual_close,
+       (bj.run_mode = 'scheduled' AND bj.status = 'SCHEDULED' AND bi.status = 'READY') AS can_cancel_scheduled,
+       CASE bi.status
+           WHEN 'ERROR' THEN 'ERROR'
+           WHEN 'READY' THEN 'READY'
+           ELSE {_sql_order_status_label("oe.status", "UNSENT")}
+       END AS entry_status_label,
+       oe.sent_at AS entry_sent_at,
+       CASE WHEN oe.cum_qty THEN oe.avg_price * oe.cum_qty END AS entry_fill_amount,
+       CASE
+           WHEN bi.status = 'ERROR' THEN 'ERROR'
+           WHEN bi.status = 'ENTRY_FILLED_WAIT_PRICE' THEN 'WAIT_PRICE'
+           WHEN bi.status IN ('READY', 'ENTRY_SENDING', 'ENTRY_SENT', 'ENTRY_PARTIAL', 'ENTRY_FILLED') THEN 'WAITING'
+           WHEN bi.status = 'BRACKET_SENT' THEN {_sql_order_status_label("otp.status", "NEW")}
+           ELSE {_sql_order_status_label("otp.status", "WAITING")}
+       END AS tp_status_label,
+       otp.sent_at AS tp_sent_at,
+       CASE WHEN otp.cum_qty THEN otp.avg_price * otp.cum_qty END AS tp_fill_amount,
+       CASE
+           WHEN bi.status = 'ERROR' THEN 'ERROR'
+           WHEN bi.status = 'ENTRY_FILLED_WAIT_PRICE' THEN 'WAIT_PRICE'
+           WHEN bi.status IN ('READY', 'ENTRY_SENDING', 'ENTRY_SENT', 'ENTRY_PARTIAL', 'ENTRY_FILLED') THEN 'WAITING'
+           WHEN bi.status = 'BRACKET_SENT' THEN {_sql_order_status_label("osl.status", "NEW")}
+           ELSE {_sql_order_status_label("osl.status", "WAITING")}
+       END AS sl_status_label,
+       osl.sent_at AS sl_sent_at,
+       CASE WHEN osl.cum_qty THEN osl.avg_price * osl.cum_qty END AS sl_fill_amount
+FROM batch_items bi
+JOIN batch_jobs bj ON bj.id = bi.batch_job_id
+LEFT JOIN orders oe ON oe.api_order_id = bi.entry_order_id
+LEFT JOIN orders otp ON otp.api_order_id = bi.tp_order_id
+LEFT JOIN orders osl ON osl.api_order_id = bi.sl_order_id
+WHERE bj.status IN ('SCHEDULED', 'RUNNING')
+  AND bi.status != 'CLOSED'
+ORDER BY bi.updated_at DESC, bi.id DESC
+LIMIT {_EXEC_STATUS_CARD_LIMIT}
+"""
+
+# 通知済みの位置 (updated_at, id) より後の発注エラーと、起動時にその位置を既存エラーの末尾に合わせる文
+_SQL_NEW_ERRORS = """
+SELECT bi.id,
+       bi.symbol,
+       bi.last_error,
+       bi.updated_at,
+       bj.id AS batch_job_id,
+       bj.status AS batch_status,
+       bj.run_mode
+FROM batch_items bi
+JOIN batch_jobs bj ON bj.id = bi.batch_job_id
+WHERE bi.status='ERROR'
+  AND COALESCE(TRIM(bi.last_error), '') != ''
+  AND (bi.updated_at > ? OR (bi.updated_at = ? AND bi.id > ?))
+ORDER BY bi.updated_at, bi.id
+"""
+
+_SQL_PRIME_ERRORS = """
+SELECT bi.updated_at, bi.id
+FROM batch_items bi
+JOIN batch_jobs bj ON bj.id = bi.batch_job_id
+WHERE bi.status='ERROR'
+  AND COALESCE(TRIM(bi.last_error), '') != ''
+ORDER BY bi.updated_at DESC, bi.id DESC
+LIMIT 1
+"""
+
+_SQL_GET_ACTIVE_API = """
+SELECT id, name, base_url, api_password_enc, is_active
+FROM api_accounts
+WHERE is_active = 1
+ORDER BY id DESC
+LIMIT 1
+"""
+
+_SQL_TRIGGER_SCHEDULED_JOBS = f"""
+UPDATE batch_jobs
+SET status='RUNNING', updated_at={_NOW_JST_SQL}
+WHERE status='SCHEDULED' AND run_mode='scheduled' AND scheduled_at IS NOT NULL AND scheduled_at <= ?
+RETURNING id
+"""
+
+_SQL_TRIGGER_IMMEDIATE_JOBS = f"""
+UPDATE batch_jobs
+SET status='RUNNING', updated_at={_NOW_JST_SQL}
+WHERE status='SCHEDULED' AND run_mode='immediate'
+RETURNING id
+"""
+
+# 監視ループで処理すべきジョブ（実行中・即時実行待ち・予約時刻が近いもの）が1件でもあるか
+_SQL_HAS_PENDING_JOBS = """
+SELECT EXISTS (
+    SELECT 1 FROM batch_jobs
+    WHERE status='RUNNING'
+       OR (status='SCHEDULED' AND (run_mode='immediate' OR (scheduled_at IS NOT NULL AND scheduled_at <= ?)))
+)
+"""
+
+# 発注前にREADYの明細をENTRY_SENDINGへ確保し、確保できた行だけを送る。結果の書き込みに失敗しても再送しない
+_SQL_CLAIM_EXECUTION_TARGETS = """
+UPDATE batch_items
+SET updated_at=?, status='ENTRY_SENDING'
+WHERE status='READY'
+  AND batch_job_id IN (SELECT id FROM batch_jobs WHERE status='RUNNING')
+RETURNING *
+"""
+
+# 送信結果を記録する前に終了した明細は、発注されたか分からないので起動時にERRORへ倒す
+_SQL_FAIL_INTERRUPTED_ENTRIES = """
+UPDATE batch_items
+SET updated_at=?, status='ERROR', last_error=?
+WHERE status='ENTRY_SENDING'
+RETURNING id, batch_job_id
+"""
+
+# 実行中ジョブに発注済みの明細が1件もなければ、/orders と /positions を問い合わせる必要がない
+_SQL_HAS_SYNC_TARGETS = """
+SELECT EXISTS (
+    SELECT 1
+    FROM batch_items bi
+    JOIN batch_jobs bj ON bj.id = bi.batch_job_id
+    WHERE bj.status='RUNNING'
+      AND COALESCE(bi.entry_order_id, bi.tp_order_id, bi.sl_order_id, bi.eod_order_id) IS NOT NULL
+)
+"""
+
+_SQL_SYNC_TRACKED_ITEMS = """
+SELECT bi.id AS batch_item_id, bi.batch_job_id, bi.entry_order_id, bi.tp_order_id, bi.sl_order_id, bi.eod_order_id
+FROM batch_items bi
+JOIN batch_jobs bj ON bj.id = bi.batch_job_id
+WHERE bj.status='RUNNING'
+"""
+
+# 同期は追跡中の注文ごとに繰り返すので、時刻はSQLで毎行求めずtick先頭の_now_jst()を渡す
+_SQL_SYNC_UPDATE_ORDER = """
+UPDATE orders
+SET updated_at=?, last_sync_at=?, status=?, cum_qty=?, avg_price=?, raw_json=?
+WHERE api_order_id=?
+"""
+
+_SQL_SYNC_UPDATE_ENTRY = """
+UPDATE batch_items
+SET updated_at=?, status=?, entry_filled_qty=?, entry_avg_price=?
+WHERE id=?
+"""
+
+_SQL_HOLD_ID_CANDIDATES = """
+SELECT bi.id, bi.symbol, bi.side, bi.batch_job_id,
+       CAST(bi.entry_filled_qty AS INTEGER) - CAST(bi.closed_qty AS INTEGER) AS remaining_qty
+FROM batch_items bi
+JOIN batch_jobs bj ON bj.id = bi.batch_job_id
+WHERE product='margin'
+  AND bi.status IN ('ENTRY_FILLED','BRACKET_SENT','ENTRY_PARTIAL')
+  AND (bi.hold_id IS NULL OR bi.hold_id='')
+  AND bj.status='RUNNING'
+ORDER BY bi.id ASC
+"""
+
+_SQL_OCO_TARGETS = """
+SELECT bi.*, bj.id AS batch_job_id
+FROM batch_items bi
+JOIN batch_jobs bj ON bj.id = bi.batch_job_id
+WHERE bj.status='RUNNING'
+  AND bi.status IN ('ENTRY_FILLED','ENTRY_FILLED_WAIT_PRICE')
+  AND bi.tp_order_id IS NULL
+  AND bi.sl_order_id IS NULL
+"""
+
+_SQL_INSERT_BATCH_ITEM = """
+INSERT INTO batch_items
+(batch_job_id, symbol, exchange, product, side, qty, entry_type, entry_price,
+ tp_price, sl_trigger_price, status, last_error)
+VALUES
+(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'READY', NULL)
+"""
+
+# 明細・ジョブの状態更新で繰り返し使う文。updated_at=? を取る文は先頭に_now_jst()の値を渡す
+_SQL_ITEM_SET_ERROR = "UPDATE batch_items SET updated_at=?, status='ERROR', last_error=? WHERE id=?"
+_SQL_ITEM_SET_LAST_ERROR = "UPDATE batch_items SET updated_at=?, last_error=? WHERE id=?"
+_SQL_ITEM_SET_CLOSED = "UPDATE batch_items SET updated_at=?, status='CLOSED' WHERE id=?"
+_SQL_ITEM_WAIT_PRICE = "UPDATE batch_items SET updated_at=?, status='ENTRY_FILLED_WAIT_PRICE', last_error=? WHERE id=?"
+_SQL_ITEM_ENTRY_SENT = "UPDATE batch_items SET updated_at=?, status='ENTRY_SENT', entry_order_id=?, exchange=? WHERE id=?"
+_SQL_ITEM_CLOSE_BRACKET = "UPDATE batch_items SET updated_at=?, status='CLOSED', closed_qty=? WHERE id=? AND status='BRACKET_SENT'"
+_SQL_ITEM_SET_CANCELLED = "UPDATE batch_items SET updated_at=?, status='CANCELLED' WHERE id=?"
+_SQL_ITEM_EOD_SENT = "UPDATE batch_items SET updated_at=?, status='EOD_MARKET_SENT', eod_order_id=? WHERE id=?"
+_SQL_ITEM_ASSIGN_HOLD_ID = "UPDATE batch_items SET updated_at=?, hold_id=?, last_error=NULL WHERE id=?"
+
+# パラメータ順: batch_item_id, order_role, api_order_id, side, qty, order_type, price, trigger_price, hold_id
+_SQL_RECORD_ORDER = f"""
+INSERT OR REPLACE INTO orders
+(batch_item_id, order_role, api_order_id, side, qty, order_type, price, trigger_price, hold_id, status, raw_json, updated_at)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 'NEW', '{{}}', {_NOW_JST_SQL})
+"""
+_SQL_JOB_SET_CANCELLED = "UPDATE batch_jobs SET updated_at=?, status='CANCELLED' WHERE id=?"
+_SQL_JOB_SET_DONE = "UPDATE batch_jobs SET updated_at=?, status='DONE' WHERE id=?"
+_SQL_JOB_SET_ERROR = "UPDATE batch_jobs SET updated_at=?, status='ERROR' WHERE id=?"
+
+# 実行中ジョブごとの明細数・決済済み数・エラー数。明細のないジョブは行が返らない
+_SQL_RUNNING_JOB_ITEM_COUNTS = """
+SELECT batch_job_id, COUNT(*) AS total, SUM(status='CLOSED') AS closed, SUM(status='ERROR') AS errors
+FROM batch_items
+WHERE batch_job_id IN (SELECT id FROM batch_jobs WHERE status='RUNNING')
+GROUP BY batch_job_id
+"""
+
+# TP/SLどちらかが約定したブラケットを拾う。両方約定していればTPを優先し、もう片方を取消対象にする
+_SQL_OCO_FILLED_TARGETS = """
+SELECT bi.id, bi.batch_job_id,
+       CASE WHEN otp.status='FILLED' THEN 'TP_FILLED' ELSE 'SL_FILLED' END AS event_type,
+       CASE WHEN otp.status='FILLED' THEN bi.sl_order_id ELSE bi.tp_order_id END AS cancel_order_id,
+       COALESCE(CASE WHEN otp.status='FILLED' THEN otp.cum_qty ELSE osl.cum_qty END, 0) AS filled_qty
+FROM batch_items bi
+JOIN batch_jobs bj ON bj.id=bi.batch_job_id
+LEFT JOIN orders otp ON otp.api_order_id=bi.tp_order_id
+LEFT JOIN orders osl ON osl.api_order_id=bi.sl_order_id
+WHERE bj.status='RUNNING'
+  AND bi.status='BRACKET_SENT'
+  AND (otp.status='FILLED' OR osl.status='FILLED')
+"""
+
+_SQL_EOD_TARGETS = """
+SELECT bi.*, bj.id AS batch_job_id, bj.eod_force_close
+FROM batch_items bi
+JOIN batch_jobs bj ON bj.id=bi.batch_job_id
+WHERE bj.status='RUNNING'
+  AND bj.eod_force_close=1
+  AND bi.status IN ('ENTRY_PARTIAL','ENTRY_FILLED','BRACKET_SENT')
+  AND CAST(bi.entry_filled_qty AS INTEGER) - CAST(bi.closed_qty AS INTEGER) > 0
+"""
+
+# 残数量のない明細は成行決済の対象外。残っているTP/SLを取り消せたものだけCLOSEDにする
+_SQL_EOD_EMPTY_TARGETS = """
+SELECT id, batch_job_id, tp_order_id, sl_order_id
+FROM batch_items
+WHERE batch_job_id IN (SELECT id FROM batch_jobs WHERE status='RUNNING' AND eod_force_close=1)
+  AND status IN ('ENTRY_PARTIAL','ENTRY_FILLED','BRACKET_SENT')
+  AND CAST(entry_filled_qty AS INTEGER) - CAST(closed_qty AS INTEGER) <= 0
+"""
+
+_SQL_EOD_CLOSE_FILLED = f"""
+UPDATE batch_items
+SET status='CLOSED', updated_at={_NOW_JST_SQL}
+WHERE status='EOD_MARKET_SENT'
+  AND eod_order_id IN (SELECT api_order_id FROM orders WHERE status='FILLED')
+RETURNING id, batch_job_id
+"""
+
+
+# 銘柄名・市場のキャッシュ有効期間（SQLiteのdatetime修飾子）
+_SYMBOL_CACHE_MAX_AGE = "-7 days"
+_SQL_SYMBOL_CACHE_GET = """
+SELECT exchange, name FROM symbols
+WHERE symbol=? AND fetched_at >= datetime('now','+9 hours',?)
+"""
+_SQL_SYMBOL_CACHE_PUT = f"""
+INSERT INTO symbols (symbol, exchange, name) VALUES (?, ?, ?)
+ON CONFLICT(symbol) DO UPDATE SET
+    exchange=excluded.exchange, name=excluded.name, fetched_at={_NOW_JST_SQL}
+"""
+
+_HTTP_TIMEOUT_SECONDS = 10
+
+# kabuステーションAPIのエラーコード(文字列化したもの)ごとの対処ヒント
+_API_ERROR_HINTS = {
+    "4001013": (
+        "APIパスワード不一致の可能性があります。"
+        "kabuステーション側のAPIパスワードと、本アプリに保存したパスワード、"
+        "およびBase URL（本番: http://localhost:18080/kabusapi / 検証: http://localhost:18081/kabusapi）"
+        "を確認してください。"
+    ),
+}
+
+# DB読込に失敗したことを「アクティブな設定なし(None)」と区別するための印
+_API_LOAD_FAILED = object()
+
+
+if orjson is not None:
+    def _json_dumps_bytes(obj) -> bytes:
+        return orjson.dumps(obj)
+
+    def _json_loads(data: bytes | str):
+        return orjson.loads(data)
+else:
+    def _json_dumps_bytes(obj) -> bytes:
+        return json.dumps(obj).encode("utf-8")
+
+    def _json_loads(data: bytes | str):
+        return json.loads(data)
+
+# ログやraw_jsonに保存する日本語をエスケープしないJSON文字列。json.dumps と違い、呼び出しごとにエンコーダを作らない
+_json_dumps_text = json.JSONEncoder(ensure_ascii=False).encode
 
 @dataclass
 class ApiAccount:
@@ -24,27 +458,85 @@ class ApiAccount:
     api_password_enc: str
     is_active: bool = True
 
+    @cached_property
+    def normalized_base_url(self) -> str:
+        return AppLogic._normalize_base_url(self.base_url)
+
+
+class _CallableTask(QRunnable):
+    def __init__(self, fn):
+        super().__init__()
+        self._fn = fn
+
+    def run(self) -> None:
+        self._fn()
+
 
 class AppLogic(QObject):
+    # 銘柄照会スレッドからGUIスレッドへ結果を渡す (row_widget, 銘柄名, 現在値, ステータス文)
+    symbol_lookup_done = Signal(object, str, str, str)
+    # 監視スレッドからGUIスレッドへの通知。周期中のエラー文、監視画面の (状態, カード一覧)、発注エラーのトースト本文
+    worker_tick_failed = Signal(str)
+    execution_status_ready = Signal(object, object)
+    item_errors_found = Signal(str)
+    # 監視スレッドで処理した手動決済の結果トースト (タイトル, 本文, エラーか)
+    toast_requested = Signal(str, str, bool)
+    # 終了時にGUIスレッドから監視スレッドのタイマーを止める(タイマーは所属スレッドでしか止められない)
+    worker_stop_requested = Signal()
+
     def __init__(self, window: MainWindow, db_path: str):
         super().__init__()
         self.window = window
         self.db_path = db_path
         self._api_token: Optional[str] = None
         self._api_token_base_url: Optional[str] = None
+        self._api_token_negative_until = 0.0
+        self._api_token_lock = threading.Lock()
         self._last_api_token_error: Optional[Exception] = None
         self._last_api_token_error_detail: Optional[str] = None
+        self._worker_thread: Optional[QThread] = None
         self._worker_timer: Optional[QTimer] = None
         self._worker_busy = False
-        self._notified_error_keys: set[str] = set()
+        self._worker_stopping = False
+        self._http_local = threading.local()
+        # スレッドごとの keep-alive 接続表。終了時にまとめて閉じるため、作った表をここにも控える
+        self._http_conn_maps: list[dict] = []
+        self._http_conn_maps_lock = threading.Lock()
+        # 発注・取消・照会の並行呼び出しはこの常駐スレッドに流し、スレッド側の keep-alive 接続を使い回す
+        self._api_executor = ThreadPoolExecutor(max_workers=_ORDER_API_MAX_WORKERS, thread_name_prefix="kabu-api")
+        # 手動決済はGUIスレッドで受け付け、監視スレッドが次の周期の先頭で発注する
+        self._manual_close_requests: queue.SimpleQueue[int] = queue.SimpleQueue()
+        self._ui_conn: Optional[sqlite3.Connection] = None
+        self._ui_data_version: Optional[int] = None
+        self._symbol_exchange_cache: dict[str, int] = {}
+        self._active_api_cache: Optional[ApiAccount] = None
+        self._active_api_loaded = False
+        self._error_watermark: tuple[str, int] = ("", 0)
+        self._order_id_key: Optional[str] = None
+        self._refresh_ema = 0.0
+        self._ui_last_render_monotonic = 0.0
+        self._next_db_optimize_monotonic = time.monotonic() + _DB_OPTIMIZE_INTERVAL_SECONDS
+        self._write_queue: queue.Queue = queue.Queue(maxsize=_WRITE_QUEUE_MAXSIZE)
+        self._dropped_log_events = 0
+        self._log_writer_thread: Optional[threading.Thread] = None
+        self._db_pool: queue.LifoQueue[sqlite3.Connection] = queue.LifoQueue(maxsize=_DB_POOL_SIZE)
+        self._debug_enabled = _PAYLOAD_DEBUG_ENABLED
+        self.symbol_lookup_done.connect(self._apply_symbol_lookup)
+        self.worker_tick_failed.connect(self._on_worker_tick_failed)
+        self.execution_status_ready.connect(self._apply_execution_status)
+        self.item_errors_found.connect(self._show_item_errors)
+        self.toast_requested.connect(self._show_toast)
         self._init_db()
-        self._prime_notified_error_keys()
+        # 起動時にERRORへ倒した明細も最初の周期でトースト通知されるよう、既知のエラー位置を先に控える
+        self._prime_error_watermark()
+        self._fail_interrupted_entries()
+        self._start_log_writer()
 
     @staticmethod
     def _normalize_base_url(base_url: str) -> str:
         normalized = base_url.strip().rstrip("/")
-        if normalized.endswith("/token"):
-            normalized = normalized[: -len("/token")]
+        if normalized.endswith(_TOKEN_SUFFIX):
+            normalized = normalized[:-_TOKEN_SUFFIX_LEN]
         return normalized
     
     def bind(self):
@@ -58,18 +550,72 @@ class AppLogic(QObject):
         w.request_manual_close.connect(self.manual_close_item)
         w.request_cancel_scheduled.connect(self.cancel_scheduled_item)
 
-        self._worker_timer = QTimer(self)
-        self._worker_timer.timeout.connect(self._worker_tick)
-        self._worker_timer.start(2_000)
+        # 発注・同期の各ステップはGUIを止めないよう専用スレッドのタイマーで回す
+        self._worker_thread = QThread(self)
+        self._worker_timer = QTimer()
+        self._worker_timer.setInterval(2_000)
+        self._worker_timer.moveToThread(self._worker_thread)
+        self._worker_timer.timeout.connect(self._worker_tick, Qt.ConnectionType.DirectConnection)
+        self._worker_thread.started.connect(self._worker_timer.start)
+        self._worker_thread.finished.connect(self._worker_timer.stop, Qt.ConnectionType.DirectConnection)
+        self.worker_stop_requested.connect(self._worker_timer.stop)
+        self._worker_thread.start()
     # ---------- DB ----------
-    def _conn(self) -> sqlite3.Connection:
-        conn = sqlite3.connect(self.db_path, timeout=30)
+    def _open_connection(self) -> sqlite3.Connection:
+        # プールした接続は監視ループと書き込みスレッドの間で貸し借りするため、スレッド検査を外す
+        conn = sqlite3.connect(self.db_path, timeout=30, cached_statements=256, check_same_thread=False)
         conn.row_factory = sqlite3.Row
-        conn.execute("PRAGMA busy_timeout = 30000;")
-        conn.execute("PRAGMA foreign_keys = ON;")
+        for pragma in _CONNECTION_PRAGMAS:
+            conn.execute(pragma)
         return conn
 
-    def _run_with_db_retry(self, action, retries: int = 3, sleep_seconds: float = 0.15):
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._db_pool.get_nowait()
+        except queue.Empty:
+            # 入れ子で使われてプールが空のときは待たずに新しく開く
+            return self._open_connection()
+
+    def _release(self, conn: sqlite3.Connection) -> None:
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._db_pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    @contextmanager
+    def _conn(self) -> Iterator[sqlite3.Connection]:
+        conn = self._acquire()
+        try:
+            with conn:
+                yield conn
+        finally:
+            self._release(conn)
+
+    def _close_pool(self) -> None:
+        optimized = False
+        while True:
+            try:
+                conn = self._db_pool.get_nowait()
+            except queue.Empty:
+                return
+            if not optimized:
+                # 使い続けた接続が集めたクエリ傾向をもとに、必要な統計だけを更新してから閉じる
+                try:
+                    conn.execute("PRAGMA optimize")
+                    optimized = True
+                except sqlite3.Error:
+                    pass
+            conn.close()
+
+    def _run_with_db_retry(
+        self,
+        action,
+        retries: int = _DB_RETRY_COUNT,
+        base_seconds: float = _DB_RETRY_BASE_SECONDS,
+        cap_seconds: float = _DB_RETRY_CAP_SECONDS,
+    ):
         for attempt in range(retries + 1):
             try:
                 with self._conn() as conn:
@@ -77,16 +623,17 @@ class AppLogic(QObject):
             except sqlite3.OperationalError as e:
                 if "database is locked" not in str(e).lower() or attempt >= retries:
                     raise
-                time.sleep(sleep_seconds * (attempt + 1))
+                # 指数バックオフ＋フルジッターで、UI操作と監視ループの再試行が同じ間隔で重ならないようにする
+                time.sleep(min(cap_seconds, base_seconds * 2 ** attempt) * random.random())
 
-    def _ensure_column(self, conn: sqlite3.Connection, table: str, column: str, ddl: str) -> None:
-        cols = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})").fetchall()}
-        if column not in cols:
-            conn.execute(f"ALTER TABLE {table} ADD COLUMN {ddl}")
+    @staticmethod
+    def _table_columns(conn: sqlite3.Connection, table: str) -> set[str]:
+        return {row["name"] for row in conn.execute("SELECT name FROM pragma_table_info(?)", (table,)).fetchall()}
 
     def _init_db(self) -> None:
         with self._conn() as conn:
-            conn.execute("PRAGMA journal_mode = WAL;")
+            # DDLは暗黙トランザクションの対象外なので、明示的にまとめて1回のコミットにする
+            conn.execute("BEGIN")
             conn.execute(
                 """
                 CREATE TABLE IF NOT EXISTS api_accounts (
@@ -179,15 +726,29 @@ class AppLogic(QObject):
                 );
                 """
             )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS symbols (
+                    symbol TEXT PRIMARY KEY,
+                    exchange INTEGER NOT NULL,
+                    name TEXT NOT NULL,
+                    fetched_at DATETIME NOT NULL DEFAULT (datetime('now','+9 hours'))
+                );
+                """
+            )
+
+            # 後から追加した列は、既存列を1回だけ調べてから足りない分をALTERで追加する
+            item_columns = self._table_columns(conn, "batch_items")
+            for column, ddl in _BATCH_ITEM_ADDED_COLUMNS:
+                if column not in item_columns:
+                    conn.execute(f"ALTER TABLE batch_items ADD COLUMN {ddl}")
 
-            self._ensure_column(conn, "batch_items", "entry_order_id", "entry_order_id TEXT")
-            self._ensure_column(conn, "batch_items", "tp_order_id", "tp_order_id TEXT")
-            self._ensure_column(conn, "batch_items", "sl_order_id", "sl_order_id TEXT")
-            self._ensure_column(conn, "batch_items", "eod_order_id", "eod_order_id TEXT")
-            self._ensure_column(conn, "batch_items", "entry_filled_qty", "entry_filled_qty INTEGER NOT NULL DEFAULT 0")
-            self._ensure_column(conn, "batch_items", "entry_avg_price", "entry_avg_price REAL")
-            self._ensure_column(conn, "batch_items", "closed_qty", "closed_qty INTEGER NOT NULL DEFAULT 0")
-            self._ensure_column(conn, "batch_items", "hold_id", "hold_id TEXT")
+            # 監視ループが毎周期たどる絞り込み・結合列の索引。orders.api_order_id はUNIQUE制約の索引を使う
+            for index_sql in _SCHEMA_INDEXES:
+                conn.execute(index_sql)
+            # 統計が無い初回だけ集計する。以降の更新は定期的な PRAGMA optimize に任せる
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE name='sqlite_stat1'").fetchone() is None:
+                conn.execute("ANALYZE")
 
     def _log_event(
         self,
@@ -198,30 +759,86 @@ class AppLogic(QObject):
         conn: Optional[sqlite3.Connection] = None,
     ) -> None:
         if conn is not None:
-            conn.execute(
-                "INSERT INTO event_logs (batch_job_id, level, event_type, message) VALUES (?, ?, ?, ?)",
-                (batch_job_id, level, event_type, message),
-            )
+            conn.execute(_SQL_INSERT_EVENT_LOG, (batch_job_id, level, event_type, message))
             return
 
-        with self._conn() as local_conn:
-            local_conn.execute(
-                "INSERT INTO event_logs (batch_job_id, level, event_type, message) VALUES (?, ?, ?, ?)",
-                (batch_job_id, level, event_type, message),
-            )
+        # 状態遷移と同一トランザクションでない記録は、書き込みスレッドへ回して監視ループを止めない
+        created_at = self._now_jst()
+        try:
+            self._write_queue.put_nowait((batch_job_id, level, event_type, message, created_at))
+        except queue.Full:
+            self._dropped_log_events += 1
+
+    @staticmethod
+    def _log_events_bulk(conn: sqlite3.Connection, events: list[tuple[int, str, str, str]]) -> None:
+        if events:
+            conn.executemany(_SQL_INSERT_EVENT_LOG, events)
+
+    @staticmethod
+    def _now_jst() -> str:
+        return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(time.time() + 9 * 3600))
+
+    def _start_log_writer(self) -> None:
+        self._log_writer_thread = threading.Thread(target=self._log_writer_loop, name="event-log-writer", daemon=True)
+        self._log_writer_thread.start()
+
+    def _log_writer_loop(self) -> None:
+        while True:
+            first = self._write_queue.get()
+            batch = [first]
+            # 1tick中に散発的に届くログを少し待ってから1トランザクションにまとめる
+            deadline = time.monotonic() + _WRITE_LINGER_SECONDS
+            while batch[-1] is not None and len(batch) < _WRITE_BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._write_queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            rows = [entry for entry in batch if entry is not None]
+            if rows:
+                try:
+                    self._run_with_db_retry(lambda conn: conn.executemany(_SQL_INSERT_EVENT_LOG_AT, rows))
+                except Exception:
+                    self._dropped_log_events += len(rows)
+            if None in batch:
+                return
+
+    def shutdown(self) -> None:
+        if self._worker_thread is not None:
+            # 周期中の発注はHTTPタイムアウトまで待つことがあるので、残りのステップを打ち切らせてから
+            # スレッドが抜けるまで待ち、実行中の周期が使う接続やスレッドプールを先に閉じないようにする
+            self._worker_stopping = True
+            self.worker_stop_requested.emit()
+            self._worker_thread.quit()
+            self._worker_thread.wait()
+        thread = self._log_writer_thread
+        if thread is not None and thread.is_alive():
+            self._write_queue.put(None)
+            thread.join(timeout=5)
+        self._api_executor.shutdown(wait=True)
+        self._close_http_connections()
+        if self._ui_conn is not None:
+            self._ui_conn.close()
+            self._ui_conn = None
+        self._close_pool()
 
     def _get_active_api_account(self) -> Optional[ApiAccount]:
+        # API設定を書き換えるのはsave_api_accountだけなので、保存時に捨てるまで読込結果を使い回す
+        if self._active_api_loaded:
+            return self._active_api_cache
+        api = self._load_active_api_account()
+        if api is not _API_LOAD_FAILED:
+            self._active_api_cache = api
+            self._active_api_loaded = True
+            return api
+        return None
+
+    def _load_active_api_account(self):
         try:
             with self._conn() as conn:
-                row = conn.execute(
-                    """
-                    SELECT id, name, base_url, api_password_enc, is_active
-                    FROM api_accounts
-                    WHERE is_active = 1
-                    ORDER BY id DESC
-                    LIMIT 1
-                    """
-                ).fetchone()
+                row = conn.execute(_SQL_GET_ACTIVE_API).fetchone()
             if not row:
                 return None
             return ApiAccount(
@@ -232,24 +849,93 @@ class AppLogic(QObject):
                 is_active=bool(row["is_active"]),
             )
         except Exception:
-            return None
+            return _API_LOAD_FAILED
 
     def _request_json(self, method: str, url: str, headers: Optional[dict] = None, payload: Optional[dict] = None):
         data = None
         request_headers = headers or {}
         if payload is not None:
-            data = json.dumps(payload).encode("utf-8")
+            data = _json_dumps_bytes(payload)
             request_headers = {"Content-Type": "application/json", **request_headers}
-        req = urllib.request.Request(url, data=data, headers=request_headers, method=method)
-        with urllib.request.urlopen(req, timeout=10) as resp:
-            return json.loads(resp.read().decode("utf-8"))
+        parts = urllib.parse.urlsplit(url)
+        path = parts.path or "/"
+        if parts.query:
+            path = f"{path}?{parts.query}"
+        status, reason, resp_headers, body = self._send_http(method, parts.scheme, parts.netloc, path, data, request_headers)
+        if not 200 <= status < 300:
+            # 認証切れのトークンは捨て、次回の_get_api_tokenで取り直させる。
+            # /token自体はX-API-KEYを付けないので、ロック保持中の取り直しからここでロックを取ることはない
+            expired_token = request_headers.get("X-API-KEY")
+            if status == 401 and expired_token:
+                self._invalidate_api_token(expired_token)
+            raise urllib.error.HTTPError(url, status, reason, resp_headers, io.BytesIO(body))
+        return _json_loads(body)
+
+    def _send_http(self, method: str, scheme: str, netloc: str, path: str, data: Optional[bytes], headers: dict):
+        # 照会系(GET)はスレッドごとに keep-alive 接続を使い回し、リクエスト毎のTCP接続を省く。
+        # 発注・取消は再送できないので、サーバー側で切られた接続に当たらないよう毎回新しい接続で送って閉じる
+        conns = getattr(self._http_local, "conns", None)
+        if conns is None:
+            conns = self._http_local.conns = {}
+            with self._http_conn_maps_lock:
+                self._http_conn_maps.append(conns)
+        key = (scheme, netloc)
+        keep_alive = method == "GET"
+        while True:
+            conn = conns.pop(key, None) if keep_alive else None
+            reused = conn is not None
+            if not reused:
+                conn_cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+                conn = conn_cls(netloc, timeout=_HTTP_TIMEOUT_SECONDS)
+            try:
+                conn.request(method, path, body=data, headers=headers)
+                resp = conn.getresponse()
+                body = resp.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError) as e:
+                conn.close()
+                # 使い回した接続が切れていただけなら、新しい接続で1回だけやり直す
+                if reused:
+                    continue
+                raise urllib.error.URLError(e) from e
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                raise urllib.error.URLError(e) from e
+            if keep_alive and not resp.will_close:
+                conns[key] = conn
+            else:
+                conn.close()
+            return resp.status, resp.reason, resp.headers, body
+
+    def _close_http_connections(self) -> None:
+        with self._http_conn_maps_lock:
+            conn_maps, self._http_conn_maps = self._http_conn_maps, []
+        for conns in conn_maps:
+            for conn in list(conns.values()):
+                conn.close()
+            conns.clear()
 
     def _get_api_token(self, api: ApiAccount) -> Optional[str]:
-        base_url = self._normalize_base_url(api.base_url)
+        # /tokenの発行は直前のトークンを無効にするので、並行スレッドからの取り直しは1本にまとめる
+        with self._api_token_lock:
+            return self._get_api_token_locked(api)
+
+    def _invalidate_api_token(self, token: Optional[str] = None) -> None:
+        # token を渡した場合は、それが現行のトークンのときだけ捨てる(並行スレッドが取り直した新しいトークンは残す)
+        with self._api_token_lock:
+            if token is None or self._api_token == token:
+                self._api_token = None
+                self._api_token_base_url = None
+            self._api_token_negative_until = 0.0
+
+    def _get_api_token_locked(self, api: ApiAccount) -> Optional[str]:
+        base_url = api.normalized_base_url
         if self._api_token and self._api_token_base_url == base_url:
             self._last_api_token_error = None
             self._last_api_token_error_detail = None
             return self._api_token
+        # 直前に失敗していれば、しばらくは/tokenを叩かずに前回のエラーをそのまま返す
+        if time.monotonic() < self._api_token_negative_until:
+            return None
         self._last_api_token_error = None
         self._last_api_token_error_detail = None
         try:
@@ -268,7 +954,8 @@ class AppLogic(QObject):
             self._api_token = None
             self._api_token_base_url = None
             self._last_api_token_error = e
-            return None
+        self._api_token_negative_until = time.monotonic() + _TOKEN_NEGATIVE_TTL_SECONDS
+        return None
 
     def _build_last_token_error_message(self, message: str) -> str:
         if self._last_api_token_error is not None:
@@ -286,20 +973,15 @@ class AppLogic(QObject):
                 body = err.read().decode("utf-8", errors="replace")
                 if body:
                     try:
-                        body_json = json.loads(body)
+                        body_json = _json_loads(body)
                         code = body_json.get("Code") or body_json.get("code")
                         api_message = body_json.get("Message") or body_json.get("message")
                         if code is not None:
                             details.append(f"Code={code}")
                         if api_message:
                             details.append(str(api_message))
-                        if code in (4001013, "4001013"):
-                            hint = (
-                                "APIパスワード不一致の可能性があります。"
-                                "kabuステーション側のAPIパスワードと、本アプリに保存したパスワード、"
-                                "およびBase URL（本番: http://localhost:18080/kabusapi / 検証: http://localhost:18081/kabusapi）"
-                                "を確認してください。"
-                            )
+                        if code is not None:
+                            hint = _API_ERROR_HINTS.get(str(code))
                         if code is None and not api_message:
                             details.append(body)
                     except json.JSONDecodeError:
@@ -331,7 +1013,7 @@ class AppLogic(QObject):
         if not body:
             return None
         try:
-            parsed = json.loads(body)
+            parsed = _json_loads(body)
             return parsed if isinstance(parsed, dict) else None
         except json.JSONDecodeError:
             return None
@@ -357,7 +1039,7 @@ class AppLogic(QObject):
     @staticmethod
     def _normalize_exchange(exchange_value) -> int:
         exchange = int(exchange_value)
-        if exchange not in {1, 3, 5, 6, 9, 27}:
+        if exchange not in _VALID_EXCHANGES:
             raise ValueError(f"Exchangeが不正です: {exchange}")
         return exchange
     
@@ -366,10 +1048,8 @@ class AppLogic(QObject):
         current = now or datetime.now()
         if current.weekday() >= 5:
             return False
-        current_time = current.time()
-        is_morning = dt_time(9, 0) <= current_time < dt_time(11, 30)
-        is_afternoon = dt_time(12, 30) <= current_time < dt_time(15, 30)
-        return is_morning or is_afternoon
+        hms = current.hour * 10000 + current.minute * 100 + current.second
+        return _AM_OPEN_HMS <= hms < _AM_CLOSE_HMS or _PM_OPEN_HMS <= hms < _PM_CLOSE_HMS
 
     def fetch_symbol_name(self, symbol: str, row_widget):
         w = self.window
@@ -380,37 +1060,62 @@ class AppLogic(QObject):
             w.set_symbol_price(row_widget, "-")
             w.status_label.setText("API設定が未登録のため銘柄名を取得できません。")
             return
+        # HTTP照会は数秒かかることがあるので、スレッドプールで行い結果だけをシグナルでUIへ戻す
+        QThreadPool.globalInstance().start(_CallableTask(lambda: self._lookup_symbol(api, symbol, row_widget)))
 
+    def _apply_symbol_lookup(self, row_widget, symbol_name: str, price_text: str, status_text: str) -> None:
+        # 照会中に行が削除されていれば、結果ごと捨てる
+        if not shiboken6.isValid(row_widget):
+            return
+        w = self.window
+        w.set_symbol_name(row_widget, symbol_name)
+        w.set_symbol_price(row_widget, price_text)
+        w.status_label.setText(status_text)
+
+    def _lookup_symbol(self, api: ApiAccount, symbol: str, row_widget) -> None:
+        done = self.symbol_lookup_done.emit
         token = self._get_api_token(api)
         if not token:
-            w.set_symbol_name(row_widget, "取得失敗")
-            w.set_symbol_price(row_widget, "-")
-            w.status_label.setText(self._build_last_token_error_message("APIトークン取得に失敗しました。"))
+            done(row_widget, "取得失敗", "-", self._build_last_token_error_message("APIトークン取得に失敗しました。"))
             return
 
-        base_url = self._normalize_base_url(api.base_url)
-        exchange_candidates = (1, 3, 5, 6, 9)
+        base_url = api.normalized_base_url
+        cached = self._load_cached_symbol(symbol)
+        if cached is not None:
+            # 銘柄名と市場はめったに変わらないので、現在値だけを照会する
+            used_exchange, symbol_name = cached
+            board_price_text = self._fetch_board_price_text(api, token, symbol, used_exchange)
+            done(
+                row_widget,
+                symbol_name,
+                board_price_text,
+                f"銘柄情報を取得しました: {symbol_name} / 現在値={board_price_text} (Exchange={used_exchange}, キャッシュ)",
+            )
+            return
+
+        # 前回見つかった市場を先に試し、外れたときだけ残りの市場を順に当たる
+        cached_exchange = self._symbol_exchange_cache.get(symbol)
+        exchange_candidates = _SYMBOL_EXCHANGES
+        if cached_exchange is not None:
+            exchange_candidates = (cached_exchange, *(e for e in _SYMBOL_EXCHANGES if e != cached_exchange))
 
         def request_symbol_with_token(current_token: str):
             last_error: Optional[Exception] = None
             for exchange in exchange_candidates:
-                candidate_urls = (
-                    f"{base_url}/symbol/{symbol}@{exchange}",
-                    f"{base_url}/symbol/{symbol}?{urllib.parse.urlencode({'Exchange': exchange})}",
-                )
-                for candidate_url in candidate_urls:
-                    try:
-                        data = self._request_json("GET", candidate_url, headers={"X-API-KEY": current_token})
-                        if data.get("SymbolName") or data.get("DisplayName"):
-                            return data, exchange, candidate_url
-                    except urllib.error.HTTPError as e:
-                        last_error = e
-                        if e.code == 401:
-                            raise
-                        continue
-                    except Exception as e:
-                        last_error = e
-                        continue
+                candidate_url = f"{base_url}/symbol/{symbol}@{exchange}"
+                try:
+                    data = self._request_json("GET", candidate_url, headers={"X-API-KEY": current_token})
+                    if data.get("SymbolName") or data.get("DisplayName"):
+                        self._symbol_exchange_cache[symbol] = exchange
+                        return data, exchange, candidate_url
+                except urllib.error.HTTPError as e:
+                    last_error = e
+                    if e.code == 401:
+                        raise
+                    continue
+                except Exception as e:
+                    last_error = e
+                    continue
             if last_error:
                 raise last_error
             raise RuntimeError("銘柄情報取得に失敗しました。")
@@ -420,55 +1125,73 @@ class AppLogic(QObject):
             data, used_exchange, used_url = request_symbol_with_token(token)
         except urllib.error.HTTPError as e:
             if e.code == 401:
-                self._api_token = None
+                self._invalidate_api_token(token)
                 token = self._get_api_token(api)
                 if token:
                     try:
                         data, used_exchange, used_url = request_symbol_with_token(token)
                     except Exception as retry_error:
-                        w.set_symbol_name(row_widget, "取得失敗")
-                        w.set_symbol_price(row_widget, "-")
-                        w.status_label.setText(self._build_api_error_message("銘柄名の取得に失敗しました。", retry_error))
+                        done(row_widget, "取得失敗", "-", self._build_api_error_message("銘柄名の取得に失敗しました。", retry_error))
                         return
                 else:
-                    w.set_symbol_name(row_widget, "取得失敗")
-                    w.set_symbol_price(row_widget, "-")
-                    w.status_label.setText("APIトークン再取得に失敗しました。")
+                    done(row_widget, "取得失敗", "-", "APIトークン再取得に失敗しました。")
                     return
             else:
-                w.set_symbol_name(row_widget, "取得失敗")
-                w.set_symbol_price(row_widget, "-")
-                w.status_label.setText(self._build_api_error_message("銘柄名の取得に失敗しました。", e))
+                done(row_widget, "取得失敗", "-", self._build_api_error_message("銘柄名の取得に失敗しました。", e))
                 return
         except Exception as e:
-            w.set_symbol_name(row_widget, "取得失敗")
-            w.set_symbol_price(row_widget, "-")
-            w.status_label.setText(self._build_api_error_message("銘柄名の取得に失敗しました。", e))
+            done(row_widget, "取得失敗", "-", self._build_api_error_message("銘柄名の取得に失敗しました。", e))
             return
 
         symbol_name = data.get("SymbolName") or data.get("DisplayName") or ""
         if not symbol_name:
-            w.set_symbol_name(row_widget, "未取得")
-            w.set_symbol_price(row_widget, "-")
-            w.status_label.setText("銘柄名が見つかりませんでした。")
+            done(row_widget, "未取得", "-", "銘柄名が見つかりませんでした。")
             return
-        board_price_text = "-"
+        self._store_cached_symbol(symbol, used_exchange, symbol_name)
+        board_price_text = self._fetch_board_price_text(api, token, symbol, used_exchange)
+        done(
+            row_widget,
+            symbol_name,
+            board_price_text,
+            f"銘柄情報を取得しました: {symbol_name} / 現在値={board_price_text} (Exchange={used_exchange}, URL={used_url})",
+        )
+
+    def _fetch_board_price_text(self, api: ApiAccount, token: str, symbol: str, exchange: int) -> str:
+        url = f"{api.normalized_base_url}/board/{symbol}@{exchange}"
         try:
-            board_data = self._request_json(
-                "GET",
-                f"{base_url}/board/{symbol}@{used_exchange}",
-                headers={"X-API-KEY": token},
-            )
-            current_price = board_data.get("CurrentPrice")
-            if current_price is not None:
-                board_price_text = f"{current_price} 円"
+            try:
+                board_data = self._request_json("GET", url, headers={"X-API-KEY": token})
+            except urllib.error.HTTPError as e:
+                if e.code != 401:
+                    raise
+                # キャッシュ経由だと銘柄照会を通らないので、ここで期限切れトークンを取り直す
+                self._invalidate_api_token(token)
+                token = self._get_api_token(api)
+                if not token:
+                    return "取得失敗"
+                board_data = self._request_json("GET", url, headers={"X-API-KEY": token})
         except Exception:
-            board_price_text = "取得失敗"
-        w.set_symbol_name(row_widget, symbol_name)
-        w.set_symbol_price(row_widget, board_price_text)
-        w.status_label.setText(
-            f"銘柄情報を取得しました: {symbol_name} / 現在値={board_price_text} (Exchange={used_exchange}, URL={used_url})"
-        )
+            return "取得失敗"
+        current_price = board_data.get("CurrentPrice")
+        return f"{current_price} 円" if current_price is not None else "-"
+
+    def _load_cached_symbol(self, symbol: str) -> Optional[tuple[int, str]]:
+        try:
+            with self._conn() as conn:
+                row = conn.execute(_SQL_SYMBOL_CACHE_GET, (symbol, _SYMBOL_CACHE_MAX_AGE)).fetchone()
+        except sqlite3.Error:
+            return None
+        if row is None:
+            return None
+        self._symbol_exchange_cache[symbol] = int(row["exchange"])
+        return int(row["exchange"]), str(row["name"])
+
+    def _store_cached_symbol(self, symbol: str, exchange: int, name: str) -> None:
+        try:
+            with self._conn() as conn:
+                conn.execute(_SQL_SYMBOL_CACHE_PUT, (symbol, int(exchange), name))
+        except sqlite3.Error:
+            pass
     # ---------- API SETTINGS ----------
     def save_api_account(self):
         w = self.window
@@ -483,18 +1206,24 @@ class AppLogic(QObject):
 
         api = ApiAccount(id=0, name=name, base_url=base_url, api_password_enc=pw, is_active=active)
 
+        def _write_account(conn: sqlite3.Connection):
+            # 無効化と追加の間で書き込みロックを取り直さないよう、最初に確保しておく
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("UPDATE api_accounts SET is_active=0 WHERE is_active=1;")
+            return conn.execute(
+                """
+                INSERT INTO api_accounts (name, base_url, api_password_enc, is_active)
+                VALUES (?, ?, ?, ?)
+                """,
+                (api.name, api.base_url, api.api_password_enc, 1 if api.is_active else 0),
+            ).lastrowid
+
         try:
-            with self._conn() as conn:
-                conn.execute("UPDATE api_accounts SET is_active=0 WHERE is_active=1;")
-                conn.execute(
-                    """
-                    INSERT INTO api_accounts (name, base_url, api_password_enc, is_active)
-                    VALUES (?, ?, ?, ?)
-                    """,
-                    (api.name, api.base_url, api.api_password_enc, 1 if api.is_active else 0),
-                )
-            self._api_token = None
-            self._api_token_base_url = None
+            api.id = int(self._run_with_db_retry(_write_account))
+            # 保存した行がそのままアクティブ設定になるので、読み直さずにキャッシュへ入れる
+            self._active_api_cache = api if api.is_active else None
+            self._active_api_loaded = True
+            self._invalidate_api_token()
             w.toast("保存完了", "API設定を保存しました。")
         except Exception as e:
             w.toast("保存失敗", f"DB保存に失敗: {e}", error=True)
@@ -530,67 +1259,64 @@ class AppLogic(QObject):
         self.window.toast("クリア", "注文内容をクリアしました。")
 
     def manual_close_item(self, item_id: int):
+        # 発注は監視ループと同じスレッドで直列に行い、同じ明細へ並行して発注しないようにする
+        self._manual_close_requests.put(int(item_id))
+
+    def _manual_close_step(self):
+        while not self._worker_stopping:
+            try:
+                item_id = self._manual_close_requests.get_nowait()
+            except queue.Empty:
+                return
+            self._manual_close_item(item_id)
+
+    def _manual_close_item(self, item_id: int):
+        toast = self.toast_requested.emit
         api = self._get_active_api_account()
         if not api:
-            self.window.toast("成行決済失敗", "API設定が未登録です。", error=True)
+            toast("成行決済失敗", "API設定が未登録です。", True)
             return
 
         with self._conn() as conn:
-            item = conn.execute(
-                """
-                SELECT bi.*
-                FROM batch_items bi
-                JOIN batch_jobs bj ON bj.id = bi.batch_job_id
-                WHERE bi.id=?
-                """,
-                (int(item_id),),
-            ).fetchone()
+            item = conn.execute("SELECT * FROM batch_items WHERE id=?", (int(item_id),)).fetchone()
 
         if not item:
-            self.window.toast("成行決済失敗", f"対象注文が見つかりません: id={item_id}", error=True)
+            toast("成行決済失敗", f"対象注文が見つかりません: id={item_id}", True)
             return
         if str(item["status"] or "") == "CLOSED":
-            self.window.toast("成行決済", f"既に決済済みです: id={item_id}")
+            toast("成行決済", f"既に決済済みです: id={item_id}", False)
             return
         if item["product"] == "margin" and not item["hold_id"]:
-            self.window.toast("成行決済失敗", "信用建玉のHoldIDが未取得です。", error=True)
+            toast("成行決済失敗", "信用建玉のHoldIDが未取得です。", True)
             return
 
         remaining = max(int(item["entry_filled_qty"] or 0) - int(item["closed_qty"] or 0), 0)
         if remaining <= 0:
-            self.window.toast("成行決済", f"残数量がありません: id={item_id}")
+            toast("成行決済", f"残数量がありません: id={item_id}", False)
             return
 
         try:
             self._cancel_order_if_needed(api, item["tp_order_id"])
             self._cancel_order_if_needed(api, item["sl_order_id"])
             payload = self._build_exit_payload(item, "market", remaining, None, None, item["hold_id"])
-            with self._conn() as conn:
-                self._log_payload_debug(int(item["batch_job_id"]), "MANUAL_CLOSE_PAYLOAD", payload, conn)
+            self._log_payload_debug(int(item["batch_job_id"]), "MANUAL_CLOSE_PAYLOAD", payload)
             order_id, _ = self._api_post_order(api, payload)
         except Exception as e:
             with self._conn() as conn:
                 conn.execute(
-                    "UPDATE batch_items SET status='ERROR', last_error=?, updated_at=datetime('now','+9 hours') WHERE id=?",
-                    (f"manual_close: {e}", int(item_id)),
+                    _SQL_ITEM_SET_ERROR,
+                    (self._now_jst(), f"manual_close: {e}", int(item_id)),
                 )
-            self.window.toast("成行決済失敗", str(e), error=True)
+            toast("成行決済失敗", str(e), True)
             return
 
         close_side = "sell" if item["side"] == "buy" else "buy"
         with self._conn() as conn:
             self._record_order(conn, int(item_id), "manual", order_id, close_side, remaining, "market", None, None, item["hold_id"])
-            conn.execute(
-                """
-                UPDATE batch_items
-                SET eod_order_id=?, status='EOD_MARKET_SENT', updated_at=datetime('now','+9 hours')
-                WHERE id=?
-                """,
-                (order_id, int(item_id)),
-            )
+            conn.execute(_SQL_ITEM_EOD_SENT, (self._now_jst(), order_id, int(item_id)))
             self._log_event(int(item["batch_job_id"]), "INFO", "MANUAL_MARKET_CLOSE", f"item={item_id} order_id={order_id}", conn=conn)
 
-        self.window.toast("成行決済", f"成行決済を送信しました: id={item_id}")
+        toast("成行決済", f"成行決済を送信しました: id={item_id}", False)
     def cancel_scheduled_item(self, item_id: int):
         with self._conn() as conn:
             row = conn.execute(
@@ -615,10 +1341,8 @@ class AppLogic(QObject):
                 self.window.toast("予約キャンセル不可", "既に実行フェーズに入っているためキャンセルできません。", error=True)
                 return
 
-            conn.execute(
-                "UPDATE batch_items SET status='CANCELLED', updated_at=datetime('now','+9 hours') WHERE id=?",
-                (int(item_id),),
-            )
+            now_jst = self._now_jst()
+            conn.execute(_SQL_ITEM_SET_CANCELLED, (now_jst, int(item_id)))
             self._log_event(int(row["batch_job_id"]), "INFO", "SCHEDULE_CANCELLED", f"item={item_id} を予約キャンセル", conn=conn)
 
             remain = conn.execute(
@@ -626,10 +1350,7 @@ class AppLogic(QObject):
                 (int(row["batch_job_id"]),),
             ).fetchone()[0]
             if int(remain) == 0:
-                conn.execute(
-                    "UPDATE batch_jobs SET status='CANCELLED', updated_at=datetime('now','+9 hours') WHERE id=?",
-                    (int(row["batch_job_id"]),),
-                )
+                conn.execute(_SQL_JOB_SET_CANCELLED, (now_jst, int(row["batch_job_id"])))
 
         self.window.toast("予約キャンセル", f"予約注文をキャンセルしました: id={item_id}")
     # ---------- SUBMIT ORDERS ----------
@@ -653,15 +1374,32 @@ class AppLogic(QObject):
             return
 
         # バッチ作成：batch_code は “YYYYMMDD-HHMMSS”
-        now = datetime.now()
-        batch_code = now.strftime("%Y%m%d-%H%M%S")
+        batch_code = time.strftime("%Y%m%d-%H%M%S")
         batch_name = orders[0].get("batch_name") or "手動バッチ"
         run_mode = orders[0].get("run_mode") or "immediate"
         scheduled_at = orders[0].get("scheduled_at")
         scheduled_at_value = scheduled_at if run_mode == "scheduled" else None
         initial_status = "SCHEDULED"
         try:
+            # 数値項目は get_orders_payload が型を揃えて返すので、ここでは変換せずにそのまま束ねる
+            item_rows = [
+                (
+                    o["symbol"],
+                    o["exchange"],
+                    o["product"],
+                    o["side"],
+                    o["qty"],
+                    o["entry_type"],
+                    o["entry_price"],
+                    o["tp_price"],
+                    o["sl_trigger_price"],
+                )
+                for o in orders
+            ]
+
             def _write_batch(conn: sqlite3.Connection):
+                # ジョブと全明細を1つの書き込みトランザクションで確定させる
+                conn.execute("BEGIN IMMEDIATE")
                 cur = conn.execute(
                     """
                     INSERT INTO batch_jobs (batch_code, api_account_id, name, status, run_mode, scheduled_at, eod_close_time, eod_force_close)
@@ -670,29 +1408,7 @@ class AppLogic(QObject):
                     (batch_code, api_account_id, batch_name, initial_status, run_mode, scheduled_at_value),
                 )
                 batch_job_id = cur.lastrowid
-
-                for o in orders:
-                    conn.execute(
-                        """
-                        INSERT INTO batch_items
-                        (batch_job_id, symbol, exchange, product, side, qty, entry_type, entry_price,
-                         tp_price, sl_trigger_price, status, last_error)
-                        VALUES
-                        (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'READY', NULL)
-                        """,
-                        (
-                            batch_job_id,
-                            o["symbol"],
-                            int(o["exchange"]),
-                            o["product"],
-                            o["side"],
-                            int(o["qty"]),
-                            o["entry_type"],
-                            float(o["entry_price"]) if o["entry_type"] == "limit" else None,
-                            float(o["tp_price"]),
-                            float(o["sl_trigger_price"]),
-                        ),
-                    )
+                conn.executemany(_SQL_INSERT_BATCH_ITEM, ((batch_job_id, *values) for values in item_rows))
 
                 self._log_event(
                     batch_job_id,
@@ -705,6 +1421,8 @@ class AppLogic(QObject):
                 return batch_job_id
 
             self._run_with_db_retry(_write_batch)
+            with self._conn() as conn:
+                conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
 
             w.toast("送信完了", f"バッチを作成しDBに保存しました。（items={len(orders)}）")
         except Exception as e:
@@ -720,179 +1438,145 @@ class AppLogic(QObject):
             return
         self._worker_busy = True
         try:
-            self._scheduler_step()
-            self._execution_step()
-            self._sync_orders_step()
-            self._oco_step()
-            self._eod_step()
-            self._finalize_jobs_step()
-            self._refresh_execution_status_ui()
-            self._notify_new_item_errors()
+            self._manual_close_step()
+            # 取引時間外で処理対象のジョブもなければ、各ステップのDB/HTTPアクセスを省く
+            if self._is_market_session_open() or self._has_pending_jobs():
+                for step in (
+                    self._scheduler_step,
+                    self._execution_step,
+                    self._sync_orders_step,
+                    self._oco_step,
+                    self._eod_step,
+                    self._finalize_jobs_step,
+                ):
+                    # 終了要求が来たら、残りのステップには進まない
+                    if self._worker_stopping:
+                        return
+                    step()
+            if self._worker_stopping:
+                return
+            # 画面用の読込とカード組み立ても監視スレッドで済ませ、GUIスレッドには結果だけを渡す
+            self._publish_ui_state()
+            if time.monotonic() >= self._next_db_optimize_monotonic:
+                self._next_db_optimize_monotonic = time.monotonic() + _DB_OPTIMIZE_INTERVAL_SECONDS
+                with self._conn() as conn:
+                    conn.execute("PRAGMA optimize")
         except Exception as e:
-            self.window.status_label.setText(f"監視ループでエラー: {e}")
+            self.worker_tick_failed.emit(f"監視ループでエラー: {e}")
         finally:
             self._worker_busy = False
 
-    @staticmethod
-    def _render_order_status(status: Optional[str], fallback_waiting: str = "WAITING") -> str:
-        if not status:
-            return fallback_waiting
-        normalized = str(status).strip().upper()
-        known = {"NEW", "WORKING", "PARTIAL", "FILLED", "CANCELLED", "ERROR", "UNKNOWN", "WAITING"}
-        return normalized if normalized in known else "UNKNOWN"
-        return mapping.get(status, status)
-
-    def _refresh_execution_status_ui(self) -> None:
-        with self._conn() as conn:
-            rows = conn.execute(
-                """
-                SELECT bi.id,
-                       bi.symbol,
-                       bi.side,
-                       bi.qty,
-                       bi.status AS item_status,
-                       bi.last_error,
-                       bi.entry_filled_qty,
-                       bi.closed_qty,
-                       bj.run_mode,
-                       bj.status AS job_status,
-                       oe.status AS entry_order_status,
-                       oe.sent_at AS entry_sent_at,
-                       oe.avg_price AS entry_avg_price,
-                       oe.cum_qty AS entry_cum_qty,
-                       otp.status AS tp_order_status,
-                       otp.sent_at AS tp_sent_at,
-                       otp.avg_price AS tp_avg_price,
-                       otp.cum_qty AS tp_cum_qty,
-                       osl.status AS sl_order_status,
-                       osl.sent_at AS sl_sent_at,
-                       osl.avg_price AS sl_avg_price,
-                       osl.cum_qty AS sl_cum_qty
-                FROM batch_items bi
-                JOIN batch_jobs bj ON bj.id = bi.batch_job_id
-                LEFT JOIN orders oe ON oe.api_order_id = bi.entry_order_id
-                LEFT JOIN orders otp ON otp.api_order_id = bi.tp_order_id
-                LEFT JOIN orders osl ON osl.api_order_id = bi.sl_order_id
-                WHERE bj.status IN ('SCHEDULED', 'RUNNING')
-                  AND bi.status != 'CLOSED'
-                ORDER BY bi.updated_at DESC, bi.id DESC
-                """
-            ).fetchall()
+    def _on_worker_tick_failed(self, error_message: str) -> None:
+        self.window.status_label.setText(error_message)
 
-        if not rows:
-            self.window.set_execution_status("監視対象なし", "WAITING", "WAITING", "WAITING")
-            self.window.set_open_order_cards([])
+    def _apply_execution_status(self, status: tuple, cards: list[dict]) -> None:
+        self.window.set_execution_status(*status)
+        self.window.set_open_order_cards(cards)
+
+    def _show_item_errors(self, message: str) -> None:
+        self.window.toast("注文処理エラー", message, error=True)
+
+    def _show_toast(self, title: str, message: str, error: bool) -> None:
+        self.window.toast(title, message, error=error)
+
+    def _ui_connection(self) -> sqlite3.Connection:
+        # 画面の定期読込はこの接続だけで行い、準備済みの文をプールの接続ごとに作り直させない
+        if self._ui_conn is None:
+            self._ui_conn = self._open_connection()
+        return self._ui_conn
+
+    def _publish_ui_state(self) -> None:
+        # 画面読込専用の接続は書き込みに使わないので、data_version が変わらなければ
+        # 監視画面にも発注エラーにも前回から変化はなく、どちらの読込も要らない
+        data_version = self._ui_connection().execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self._ui_data_version:
             return
+        self._notify_new_item_errors()
+        if self._refresh_execution_status():
+            self._ui_data_version = data_version
+
+    def _refresh_execution_status(self) -> bool:
+        if time.monotonic() < self._ui_last_render_monotonic:
+            return False
+        conn = self._ui_connection()
+        # 列数が多く行数も増えるため、この取得だけは Row ではなく素のタプルで受けて位置で展開する
+        cur = conn.cursor()
+        cur.row_factory = None
+        started = time.perf_counter()
+        rows = cur.execute(_SQL_EXEC_STATUS).fetchall()
+        elapsed = time.perf_counter() - started
+        # 取得時間の移動平均が閾値を超えている間は、次回の描画を先送りしてDB負荷を逃がす
+        self._refresh_ema += _REFRESH_EMA_ALPHA * (elapsed - self._refresh_ema)
+        self._ui_last_render_monotonic = time.monotonic()
+        if self._refresh_ema > _REFRESH_SLOW_SECONDS:
+            self._ui_last_render_monotonic += _REFRESH_BACKOFF_SECONDS
+
+        if not rows:
+            self.execution_status_ready.emit(("監視対象なし", "WAITING", "WAITING", "WAITING"), [])
+            return True
 
         cards: list[dict] = []
         def _fmt_sent_at(value: object) -> str:
             return str(value) if value else "-"
 
-        def _fmt_amount(avg: object, qty: object) -> str:
-            if avg is None or not qty:
-                return "-"
-            try:
-                amount = float(avg) * int(qty)
-            except Exception:
-                return "-"
-            return f"{amount:,.0f}円"
-        for row in rows:
-            item_status = str(row["item_status"] or "")
-            entry_status = self._render_order_status(row["entry_order_status"], fallback_waiting="UNSENT")
-            tp_status = self._render_order_status(row["tp_order_status"], fallback_waiting="WAITING")
-            sl_status = self._render_order_status(row["sl_order_status"], fallback_waiting="WAITING")
-
-            if item_status in {"READY", "ENTRY_SENT", "ENTRY_PARTIAL", "ENTRY_FILLED", "ENTRY_FILLED_WAIT_PRICE"}:
-                if item_status == "READY":
-                    entry_status = "READY"
-                if item_status == "ENTRY_FILLED_WAIT_PRICE":
-                    tp_status = "WAIT_PRICE"
-                    sl_status = "WAIT_PRICE"
-                else:
-                    tp_status = "WAITING"
-                    sl_status = "WAITING"
-
-            if item_status == "BRACKET_SENT":
-                tp_status = self._render_order_status(row["tp_order_status"], fallback_waiting="NEW")
-                sl_status = self._render_order_status(row["sl_order_status"], fallback_waiting="NEW")
-
-            if item_status == "ERROR":
-                entry_status = "ERROR"
-                tp_status = "ERROR"
-                sl_status = "ERROR"
-                
+        def _fmt_amount(amount: Optional[float]) -> str:
+            # 約定金額(平均価格×約定数量)はSQLで計算済み。未約定・価格不明はNULL
+            return "-" if amount is None else _YEN_FMT(amount)
+        for (
+            item_id, symbol, side, qty, item_status, last_error, entry_filled_qty, closed_qty,
+            can_manual_close, can_cancel_scheduled,
+            entry_status, entry_sent_at, entry_fill_amount,
+            tp_status, tp_sent_at, tp_fill_amount,
+            sl_status, sl_sent_at, sl_fill_amount,
+        ) in rows:
+            # 各注文の表示ラベルは明細の状態に応じて SQL 側で決めてある
+            item_status = str(item_status or "")
             cards.append({
-                "id": row["id"],
-                "symbol": row["symbol"],
-                "side_label": "買" if row["side"] == "buy" else "売",
-                "qty": int(row["qty"] or 0),
+                "id": item_id,
+                "symbol": symbol,
+                "side_label": "買" if side == "buy" else "売",
+                "qty": int(qty or 0),
                 "item_status_label": item_status,
                 "entry_status_label": entry_status,
                 "tp_status_label": tp_status,
                 "sl_status_label": sl_status,
-                "entry_filled_qty": int(row["entry_filled_qty"] or 0),
-                "closed_qty": int(row["closed_qty"] or 0),
-                "entry_sent_at": _fmt_sent_at(row["entry_sent_at"]),
-                "tp_sent_at": _fmt_sent_at(row["tp_sent_at"]),
-                "sl_sent_at": _fmt_sent_at(row["sl_sent_at"]),
-                "entry_fill_amount_text": _fmt_amount(row["entry_avg_price"], row["entry_cum_qty"]),
-                "tp_fill_amount_text": _fmt_amount(row["tp_avg_price"], row["tp_cum_qty"]),
-                "sl_fill_amount_text": _fmt_amount(row["sl_avg_price"], row["sl_cum_qty"]),
-                "can_manual_close": item_status in {"ENTRY_PARTIAL", "ENTRY_FILLED", "ENTRY_FILLED_WAIT_PRICE", "BRACKET_SENT", "EOD_MARKET_SENT"},
-                "can_cancel_scheduled": row["run_mode"] == "scheduled" and row["job_status"] == "SCHEDULED" and item_status == "READY",
-                "last_error": row["last_error"] or "",
+                "entry_filled_qty": int(entry_filled_qty or 0),
+                "closed_qty": int(closed_qty or 0),
+                "entry_sent_at": _fmt_sent_at(entry_sent_at),
+                "tp_sent_at": _fmt_sent_at(tp_sent_at),
+                "sl_sent_at": _fmt_sent_at(sl_sent_at),
+                "entry_fill_amount_text": _fmt_amount(entry_fill_amount),
+                "tp_fill_amount_text": _fmt_amount(tp_fill_amount),
+                "sl_fill_amount_text": _fmt_amount(sl_fill_amount),
+                "can_manual_close": bool(can_manual_close),
+                "can_cancel_scheduled": bool(can_cancel_scheduled),
+                "last_error": last_error or "",
             })
 
-        latest = rows[0]
+        latest = cards[0]
         target = f"#{latest['id']} {latest['symbol']}"
-        if str(latest["item_status"] or "") == "ERROR":
-            self.window.set_execution_status(target, "ERROR", "-", "-")
+        if latest["item_status_label"] == "ERROR":
+            status = (target, "ERROR", "-", "-")
         else:
-            self.window.set_execution_status(
+            status = (
                 target,
                 cards[0]["entry_status_label"],
                 cards[0]["tp_status_label"],
                 cards[0]["sl_status_label"],
             )
 
-        self.window.set_open_order_cards(cards)
+        self.execution_status_ready.emit(status, cards)
+        return True
 
     def _notify_new_item_errors(self) -> None:
-        with self._conn() as conn:
-            rows = conn.execute(
-                """
-                SELECT bi.id,
-                       bi.symbol,
-                       bi.last_error,
-                       bi.updated_at,
-                       bj.id AS batch_job_id,
-                       bj.status AS batch_status,
-                       bj.run_mode
-                FROM batch_items bi
-                JOIN batch_jobs bj ON bj.id = bi.batch_job_id
-                WHERE bi.status='ERROR'
-                  AND COALESCE(TRIM(bi.last_error), '') != ''
-                ORDER BY bi.updated_at DESC, bi.id DESC
-                LIMIT 20
-                """
-            ).fetchall()
-
-        fresh_rows: list[sqlite3.Row] = []
-        active_keys: set[str] = set()
-        for row in rows:
-            key = f"{int(row['id'])}:{row['updated_at']}"
-            active_keys.add(key)
-            if key in self._notified_error_keys:
-                continue
-            fresh_rows.append(row)
-            self._notified_error_keys.add(key)
-
-        if self._notified_error_keys:
-            self._notified_error_keys.intersection_update(active_keys)
-
-        if not fresh_rows:
+        last_ts, last_id = self._error_watermark
+        rows = self._ui_connection().execute(_SQL_NEW_ERRORS, (last_ts, last_ts, last_id)).fetchall()
+        if not rows:
             return
+        self._error_watermark = (rows[-1]["updated_at"], int(rows[-1]["id"]))
 
+        # 新しいものから表示する
+        fresh_rows = rows[::-1]
         lines = []
         for row in fresh_rows[:3]:
             lines.append(
@@ -903,68 +1587,68 @@ class AppLogic(QObject):
             lines.append(f"…ほか {remaining} 件")
 
         message = "注文処理で発注エラーを検出しました（予約キャンセル失敗ではありません）。\n" + "\n".join(lines)
-        self.window.toast("注文処理エラー", message, error=True)
+        self.item_errors_found.emit(message)
+
+    def _fail_interrupted_entries(self) -> None:
+        msg = "新規注文の送信結果を記録できませんでした。kabuステーションで注文状況を確認してください"
+        with self._conn() as conn:
+            rows = conn.execute(_SQL_FAIL_INTERRUPTED_ENTRIES, (self._now_jst(), msg)).fetchall()
+            self._log_events_bulk(
+                conn,
+                [(row["batch_job_id"], "ERROR", "ENTRY_FAILED", f"item={row['id']} err={msg}") for row in rows],
+            )
 
+    def _prime_error_watermark(self) -> None:
+        row = self._ui_connection().execute(_SQL_PRIME_ERRORS).fetchone()
+        if row:
+            self._error_watermark = (row["updated_at"], int(row["id"]))
 
-    def _prime_notified_error_keys(self) -> None:
+    def _has_pending_jobs(self) -> bool:
+        horizon = (datetime.now() + _IDLE_SCHEDULE_LOOKAHEAD).strftime("%Y-%m-%d %H:%M:%S")
         with self._conn() as conn:
-            rows = conn.execute(
-                """
-                SELECT bi.id,
-                       bi.updated_at
-                FROM batch_items bi
-                JOIN batch_jobs bj ON bj.id = bi.batch_job_id
-                WHERE bi.status='ERROR'
-                  AND COALESCE(TRIM(bi.last_error), '') != ''
-                """
-            ).fetchall()
+            return bool(conn.execute(_SQL_HAS_PENDING_JOBS, (horizon,)).fetchone()[0])
 
-        for row in rows:
-            self._notified_error_keys.add(f"{int(row['id'])}:{row['updated_at']}")
-            
     def _scheduler_step(self):
         now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         with self._conn() as conn:
-            rows = conn.execute(
-                """
-                SELECT id FROM batch_jobs
-                WHERE status='SCHEDULED' AND run_mode='scheduled' AND scheduled_at IS NOT NULL AND scheduled_at <= ?
-                """,
-                (now_str,),
-            ).fetchall()
-            for row in rows:
-                conn.execute("UPDATE batch_jobs SET status='RUNNING', updated_at=datetime('now','+9 hours') WHERE id=?", (row["id"],))
-                self._log_event(int(row["id"]), "INFO", "SCHEDULE_TRIGGERED", "予約時刻到達でRUNNINGに遷移", conn=conn)
-
-            immediate_rows = conn.execute(
-                "SELECT id FROM batch_jobs WHERE status='SCHEDULED' AND run_mode='immediate'"
-            ).fetchall()
-            for row in immediate_rows:
-                conn.execute("UPDATE batch_jobs SET status='RUNNING', updated_at=datetime('now','+9 hours') WHERE id=?", (row["id"],))
-                self._log_event(int(row["id"]), "INFO", "IMMEDIATE_TRIGGERED", "即時実行バッチを開始", conn=conn)
+            # 対象ジョブの遷移は run_mode ごとに1文で行い、遷移したIDだけを RETURNING で受け取る
+            triggered = conn.execute(_SQL_TRIGGER_SCHEDULED_JOBS, (now_str,)).fetchall()
+            immediate = conn.execute(_SQL_TRIGGER_IMMEDIATE_JOBS).fetchall()
+            events = [(int(row["id"]), "INFO", "SCHEDULE_TRIGGERED", "予約時刻到達でRUNNINGに遷移") for row in triggered]
+            events.extend((int(row["id"]), "INFO", "IMMEDIATE_TRIGGERED", "即時実行バッチを開始") for row in immediate)
+            self._log_events_bulk(conn, events)
 
     def _api_post_order(self, api: ApiAccount, payload: dict) -> tuple[str, int]:
-        token = self._get_api_token(api)
+        return self._api_post_order_with_token(api, self._get_api_token(api), payload)
+
+    def _api_post_order_with_token(self, api: ApiAccount, token: Optional[str], payload: dict) -> tuple[str, int]:
         if not token:
             raise RuntimeError(self._build_last_token_error_message("APIトークン取得に失敗"))
-        base_url = self._normalize_base_url(api.base_url)
+        base_url = api.normalized_base_url
         requested_exchange = self._normalize_exchange(payload.get("Exchange"))
         resolved_exchange = requested_exchange
         try:
-            data = self._request_json("POST", f"{base_url}/sendorder", headers={"X-API-KEY": token}, payload=payload)
+            try:
+                data = self._request_json("POST", f"{base_url}/sendorder", headers={"X-API-KEY": token}, payload=payload)
+            except urllib.error.HTTPError as e:
+                if e.code != 401:
+                    raise
+                # 401の発注は受け付けられていないので、トークンを取り直して1回だけ送り直す
+                self._invalidate_api_token(token)
+                token = self._get_api_token(api)
+                if not token:
+                    raise RuntimeError(self._build_last_token_error_message("APIトークン再取得に失敗")) from e
+                data = self._request_json("POST", f"{base_url}/sendorder", headers={"X-API-KEY": token}, payload=payload)
         except urllib.error.HTTPError as e:
             body = self._read_http_error_body(e)
             payload_ctx = self._payload_error_context(payload)
-            err_payload = self._parse_error_json(body)
-            err_code = (err_payload or {}).get("Code") or (err_payload or {}).get("code")
+            err_code = None
+            # 市場を変えて再送するのは4001005のときだけなので、本文に現れない限りJSONとして読まない
+            if "4001005" in body:
+                err_payload = self._parse_error_json(body) or {}
+                err_code = err_payload.get("Code") or err_payload.get("code")
             current_exchange = payload.get("Exchange")
-            retry_candidates_by_exchange = {
-                1: (9, 27),
-                9: (27, 1),
-                27: (9, 1),
-            }
-            retry_exchanges = retry_candidates_by_exchange.get(current_exchange, (1, 9, 27))
-            retry_exchanges = tuple(exchange for exchange in retry_exchanges if exchange != current_exchange)
+            retry_exchanges = _RETRY_EXCHANGES.get(current_exchange, _DEFAULT_RETRY_EXCHANGES)
 
             if str(err_code) == "4001005" and retry_exchanges:
                 for retry_exchange in retry_exchanges:
@@ -987,19 +1671,6 @@ class AppLogic(QObject):
             raise RuntimeError(f"注文IDが返却されませんでした: {data}")
         return str(order_id), resolved_exchange
 
-    @staticmethod
-    def _side_to_kabu(side: str) -> str:
-        return "2" if side == "buy" else "1"
-
-    @staticmethod
-    def _kabu_side_to_internal(side: object) -> Optional[str]:
-        value = str(side or "").strip()
-        if value == "1":
-            return "sell"
-        if value == "2":
-            return "buy"
-        return None
-
     @staticmethod
     def _parse_int(value: object, default: int = 0) -> int:
         try:
@@ -1008,55 +1679,62 @@ class AppLogic(QObject):
             return default
 
     @staticmethod
-    def _normalize_hold_id(hold_id: object) -> str:
-        return str(hold_id or "").strip()
+    def _hold_id_info(hold_id: object) -> tuple[str, bool]:
+        # 正規化後の建玉IDと、信用返済に使える形式（E始まり）かどうかを一度に返す
+        normalized = str(hold_id or "").strip()
+        return normalized, (len(normalized) > 0 and normalized[0] == "E")
 
-    def _extract_position_hold_id(self, position: dict) -> tuple[str, str]:
+    def _extract_position_hold_id(self, position: dict) -> tuple[str, str, bool]:
         # /positions の建玉IDは HoldID を優先し、未提供時のみ ExecutionID をフォールバック利用する
         for key in ("HoldID", "HoldId", "ExecutionID", "ExecutionId"):
-            hold_id = self._normalize_hold_id(position.get(key))
+            hold_id, is_valid = self._hold_id_info(position.get(key))
             if hold_id:
                 source = "HoldID" if key in {"HoldID", "HoldId"} else "ExecutionID"
-                return hold_id, source
-        return "", ""
-
-    @staticmethod
-    def _is_valid_hold_id(hold_id: object) -> bool:
-        normalized = str(hold_id or "").strip()
-        return normalized.startswith("E")
+                return hold_id, source, is_valid
+        return "", "", False
     
     def _build_entry_payload(self, item: sqlite3.Row) -> dict:
-        market = item["entry_type"] == "market"
-        exchange = self._normalize_exchange(item["exchange"])
-        payload = {
-            "Symbol": item["symbol"],
+        side, product, entry_type, qty, symbol, exchange = (
+            item["side"],
+            item["product"],
+            item["entry_type"],
+            int(item["qty"]),
+            item["symbol"],
+            self._normalize_exchange(item["exchange"]),
+        )
+        market = entry_type == "market"
+        return {
+            "Symbol": symbol,
             "Exchange": exchange,
             "SecurityType": 1,
-            "Side": self._side_to_kabu(item["side"]),
-            "Qty": int(item["qty"]),
+            "Side": _SIDE_TO_KABU.get(side, "1"),
+            "Qty": qty,
             "FrontOrderType": 10 if market else 20,
             "Price": 0 if market else int(item["entry_price"] or 0),
             "ExpireDay": 0,
             "AccountType": 4,
+            **(_CASH_ENTRY if product == "cash" else _MARGIN_ENTRY),
         }
-        if item["product"] == "cash":
-            payload.update({"CashMargin": 1, "DelivType": 2, "FundType": "AA"})
-        else:
-            payload.update({"CashMargin": 2, "MarginTradeType": 3, "DelivType": 0})
-        return payload
 
     def _build_exit_payload(self, item: sqlite3.Row, order_type: str, qty: int, price: Optional[float], trigger: Optional[float], hold_id: Optional[str]) -> dict:
-        close_side = "sell" if item["side"] == "buy" else "buy"
+        side, product, symbol, exchange = (
+            item["side"],
+            item["product"],
+            item["symbol"],
+            self._normalize_exchange(item["exchange"]),
+        )
+        close_side = "sell" if side == "buy" else "buy"
+        qty = int(qty)
         payload = {
-            "Symbol": item["symbol"],
-            "Exchange": self._normalize_exchange(item["exchange"]),
+            "Symbol": symbol,
+            "Exchange": exchange,
             "SecurityType": 1,
-            "Side": self._side_to_kabu(close_side),
-            "Qty": int(qty),
+            "Side": _SIDE_TO_KABU[close_side],
+            "Qty": qty,
             "ExpireDay": 0,
             "AccountType": 4,
         }
-        if item["product"] == "cash":
+        if product == "cash":
             payload["CashMargin"] = 1
             # 現物の決済系注文（保有現物の売却）は FundType を付与しない。
             # FundType は現物買付で利用する項目で、決済売りに付与すると
@@ -1069,12 +1747,12 @@ class AppLogic(QObject):
             payload["CashMargin"] = 3
             payload["MarginTradeType"] = 3
             payload["DelivType"] = 0
-            normalized_hold_id = self._normalize_hold_id(hold_id)
-            if not self._is_valid_hold_id(normalized_hold_id):
+            normalized_hold_id, is_valid_hold_id = self._hold_id_info(hold_id)
+            if not is_valid_hold_id:
                 raise RuntimeError(
-                    f"信用返済に必要なHoldIDが不正です: item={item['id']} symbol={item['symbol']} hold_id={normalized_hold_id or '<empty>'}"
+                    f"信用返済に必要なHoldIDが不正です: item={item['id']} symbol={symbol} hold_id={normalized_hold_id or '<empty>'}"
                 )
-            payload["ClosePositions"] = [{"HoldID": normalized_hold_id, "Qty": int(qty)}]
+            payload["ClosePositions"] = [{"HoldID": normalized_hold_id, "Qty": qty}]
 
         if order_type == "market":
             payload["FrontOrderType"] = 10
@@ -1110,23 +1788,17 @@ class AppLogic(QObject):
     
     @staticmethod
     def _payload_error_context(payload: dict) -> str:
-        context = {
-            "Symbol": payload.get("Symbol"),
-            "Exchange": payload.get("Exchange"),
-            "Side": payload.get("Side"),
-            "Qty": payload.get("Qty"),
-            "CashMargin": payload.get("CashMargin"),
-            "DelivType": payload.get("DelivType"),
-            "FundType": payload.get("FundType"),
-            "MarginTradeType": payload.get("MarginTradeType"),
-            "FrontOrderType": payload.get("FrontOrderType"),
-            "Price": payload.get("Price"),
-            "TriggerPrice": (payload.get("ReverseLimitOrder") or {}).get("TriggerPrice"),
-        }
-        return json.dumps(context, ensure_ascii=False)
+        context = {key: payload.get(key) for key in _PAYLOAD_CONTEXT_KEYS}
+        context["TriggerPrice"] = (payload.get("ReverseLimitOrder") or {}).get("TriggerPrice")
+        return _json_dumps_text(context)
     
     @staticmethod
     def _to_positive_float(value: object) -> Optional[float]:
+        # 約定明細は数値そのままか欠損(None)がほとんどなので、例外を経由せずに済ませる
+        if value is None:
+            return None
+        if isinstance(value, (int, float)):
+            return float(value) if value > 0 else None
         try:
             parsed = float(value)
         except (TypeError, ValueError):
@@ -1134,29 +1806,31 @@ class AppLogic(QObject):
         return parsed if parsed > 0 else None
 
     def _extract_order_avg_price(self, order: dict) -> Optional[float]:
+        # 約定数量が無い注文は平均約定単価を求める意味がない
+        if order.get("CumQty") in (0, "0", None):
+            return None
+
         primary = self._to_positive_float(order.get("Price"))
         if primary:
             return primary
 
         details = order.get("Details")
-        if not isinstance(details, list):
+        if not isinstance(details, list) or not details:
             return None
 
+        to_positive_float = self._to_positive_float
         weighted_price = 0.0
         weighted_qty = 0
         fallback = None
         for detail in details:
             if not isinstance(detail, dict):
                 continue
-            price = None
-            for key in ("RecPrice", "ExecutionPrice", "Price"):
-                price = self._to_positive_float(detail.get(key))
-                if price:
-                    break
+            get = detail.get
+            price = next((p for key in _PRICE_KEYS if (p := to_positive_float(get(key)))), None)
             if not price:
                 continue
             fallback = price
-            qty = detail.get("RecQty") or detail.get("ExecutionQty") or detail.get("Qty")
+            qty = next((q for key in _QTY_KEYS if (q := get(key))), None)
             try:
                 qty_int = int(qty)
             except (TypeError, ValueError):
@@ -1169,164 +1843,164 @@ class AppLogic(QObject):
             return weighted_price / weighted_qty
         return fallback
 
-    def _log_payload_debug(self, batch_job_id: int, event_type: str, payload: dict, conn: sqlite3.Connection) -> None:
-        details = {
-            "Symbol": payload.get("Symbol"),
-            "Exchange": payload.get("Exchange"),
-            "Side": payload.get("Side"),
-            "Qty": payload.get("Qty"),
-            "CashMargin": payload.get("CashMargin"),
-            "DelivType": payload.get("DelivType"),
-            "FundType": payload.get("FundType"),
-            "MarginTradeType": payload.get("MarginTradeType"),
-            "FrontOrderType": payload.get("FrontOrderType"),
-            "Price": payload.get("Price"),
-            "TriggerPrice": (payload.get("ReverseLimitOrder") or {}).get("TriggerPrice"),
-            "AccountType": payload.get("AccountType"),
-            "ReverseLimitOrder": payload.get("ReverseLimitOrder"),
-        }
-        self._log_event(batch_job_id, "DEBUG", event_type, json.dumps(details, ensure_ascii=False), conn=conn)
+    def _log_payload_debug(
+        self,
+        batch_job_id: int,
+        event_type: str,
+        payload: dict,
+        conn: Optional[sqlite3.Connection] = None,
+    ) -> None:
+        if not self._debug_enabled:
+            return
+        reverse_limit = payload.get("ReverseLimitOrder")
+        details = {key: payload.get(key) for key in _PAYLOAD_CONTEXT_KEYS}
+        details["TriggerPrice"] = (reverse_limit or {}).get("TriggerPrice")
+        details["AccountType"] = payload.get("AccountType")
+        details["ReverseLimitOrder"] = reverse_limit
+        self._log_event(batch_job_id, "DEBUG", event_type, _json_dumps_text(details), conn=conn)
 
     def _record_order(self, conn: sqlite3.Connection, item_id: int, role: str, api_order_id: str, side: str, qty: int, order_type: str, price: Optional[float] = None, trigger_price: Optional[float] = None, hold_id: Optional[str] = None):
-        conn.execute(
-            """
-            INSERT OR REPLACE INTO orders
-            (batch_item_id, order_role, api_order_id, side, qty, order_type, price, trigger_price, hold_id, status, raw_json, updated_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 'NEW', '{}', datetime('now','+9 hours'))
-            """,
-            (item_id, role, api_order_id, side, qty, order_type, price, trigger_price, hold_id),
-        )
+        conn.execute(_SQL_RECORD_ORDER, (item_id, role, api_order_id, side, qty, order_type, price, trigger_price, hold_id))
 
     def _execution_step(self):
         api = self._get_active_api_account()
         if not api:
             return
-        with self._conn() as conn:
-            rows = conn.execute(
-                """
-                SELECT bi.*, bj.id AS batch_job_id
-                FROM batch_items bi
-                JOIN batch_jobs bj ON bj.id = bi.batch_job_id
-                WHERE bj.status='RUNNING' AND bi.status='READY'
-                ORDER BY bi.id
-                """
-            ).fetchall()
-        for item in rows:
-            try:
-                payload = self._build_entry_payload(item)
-                with self._conn() as conn:
-                    self._log_payload_debug(int(item["batch_job_id"]), "ENTRY_PAYLOAD", payload, conn)
-                order_id, resolved_exchange = self._api_post_order(api, payload)
-            except Exception as e:
-                with self._conn() as conn:
-                    conn.execute(
-                        "UPDATE batch_items SET status='ERROR', last_error=?, updated_at=datetime('now','+9 hours') WHERE id=?",
-                        (str(e), item["id"]),
-                    )
-                    self._log_event(
-                        int(item["batch_job_id"]),
-                        "ERROR",
-                        "ENTRY_FAILED",
-                        f"item={item['id']} err={e}",
-                        conn=conn,
-                    )
+        claimed = self._run_with_db_retry(
+            lambda conn: conn.execute(_SQL_CLAIM_EXECUTION_TARGETS, (self._now_jst(),)).fetchall()
+        )
+        if not claimed:
+            return
+        rows = sorted(claimed, key=lambda row: row["id"])
+        # トークンはtick内で不変なので、明細ごとではなく1回だけ取得する
+        token = self._get_api_token(api)
+        # 新規注文も明細ごとに独立しているので、HTTP待ちを並行させてから結果をまとめて書き込む
+        results = list(self._api_executor.map(lambda item: self._submit_entry(api, token, item), rows))
+
+        now_jst = self._now_jst()
+        failed: list[tuple[str, str, int]] = []
+        sent: list[tuple[str, str, int, int]] = []
+        recorded: list[tuple] = []
+        events: list[tuple[int, str, str, str]] = []
+        for item, (order_id, resolved_exchange, err) in zip(rows, results):
+            if err is not None:
+                failed.append((now_jst, str(err), item["id"]))
+                events.append((int(item["batch_job_id"]), "ERROR", "ENTRY_FAILED", f"item={item['id']} err={err}"))
                 continue
-
-            with self._conn() as conn:
-                conn.execute(
-                    """
-                    UPDATE batch_items
-                    SET status='ENTRY_SENT', entry_order_id=?, exchange=?, updated_at=datetime('now','+9 hours')
-                    WHERE id=?
-                    """,
-                    (order_id, resolved_exchange, item["id"]),
-                )
-                self._record_order(conn, int(item["id"]), "entry", order_id, item["side"], int(item["qty"]), item["entry_type"], item["entry_price"])
-                self._log_event(
-                    int(item["batch_job_id"]),
-                    "INFO",
-                    "ENTRY_SENT",
-                    f"item={item['id']} order_id={order_id} exchange={resolved_exchange}",
-                    conn=conn,
-                )
+            sent.append((now_jst, order_id, resolved_exchange, item["id"]))
+            recorded.append((int(item["id"]), "entry", order_id, item["side"], int(item["qty"]), item["entry_type"], item["entry_price"], None, None))
+            events.append((
+                int(item["batch_job_id"]),
+                "INFO",
+                "ENTRY_SENT",
+                f"item={item['id']} order_id={order_id} exchange={resolved_exchange}",
+            ))
+
+        def _write_results(conn: sqlite3.Connection) -> None:
+            if failed:
+                conn.executemany(_SQL_ITEM_SET_ERROR, failed)
+            if sent:
+                conn.executemany(_SQL_ITEM_ENTRY_SENT, sent)
+                conn.executemany(_SQL_RECORD_ORDER, recorded)
+            self._log_events_bulk(conn, events)
+
+        self._run_with_db_retry(_write_results)
+
+    def _submit_entry(
+        self, api: ApiAccount, token: Optional[str], item: sqlite3.Row
+    ) -> tuple[Optional[str], Optional[int], Optional[Exception]]:
+        # ワーカースレッドから呼ばれるため、DBには触れずに発注結果だけを返す
+        try:
+            payload = self._build_entry_payload(item)
+            self._log_payload_debug(int(item["batch_job_id"]), "ENTRY_PAYLOAD", payload)
+            order_id, resolved_exchange = self._api_post_order_with_token(api, token, payload)
+        except Exception as e:
+            return None, None, e
+        return order_id, resolved_exchange, None
 
     def _fetch_orders_snapshot(self, api: ApiAccount) -> list[dict]:
-        token = self._get_api_token(api)
+        return self._fetch_orders_snapshot_with_token(api, self._get_api_token(api))
+
+    def _fetch_orders_snapshot_with_token(self, api: ApiAccount, token: Optional[str]) -> list[dict]:
         if not token:
             return []
-        base_url = self._normalize_base_url(api.base_url)
+        base_url = api.normalized_base_url
         data = self._request_json("GET", f"{base_url}/orders", headers={"X-API-KEY": token})
         return data if isinstance(data, list) else []
 
     def _fetch_positions_snapshot(self, api: ApiAccount) -> list[dict]:
-        token = self._get_api_token(api)
+        return self._fetch_positions_snapshot_with_token(api, self._get_api_token(api))
+
+    def _fetch_positions_snapshot_with_token(self, api: ApiAccount, token: Optional[str]) -> list[dict]:
         if not token:
             return []
-        base_url = self._normalize_base_url(api.base_url)
+        base_url = api.normalized_base_url
         data = self._request_json("GET", f"{base_url}/positions", headers={"X-API-KEY": token})
         return data if isinstance(data, list) else []
 
     @staticmethod
     def _order_status_from_api(order: dict) -> str:
         state = str(order.get("State") or order.get("state") or "")
-        if state in {"1", "2"}:
-            return "WORKING"
-        if state in {"3", "4"}:
-            return "PARTIAL"
-        if state in {"5"}:
-            return "FILLED"
-        if state in {"6", "7"}:
-            return "CANCELLED"
-        return "UNKNOWN"
+        return _STATE_TO_STATUS.get(state, "UNKNOWN")
+
+    def _resolve_order_id_key(self, snapshots: list[dict]) -> Optional[str]:
+        # /orders の注文IDキーは環境で固定なので、初回に判明したキーを使い回す
+        if self._order_id_key and any(self._order_id_key in order for order in snapshots[:1]):
+            return self._order_id_key
+        for order in snapshots:
+            for key in _ORDER_ID_KEYS:
+                if order.get(key):
+                    self._order_id_key = key
+                    return key
+        return None
 
     def _sync_orders_step(self):
         api = self._get_active_api_account()
         if not api:
             return
+        with self._conn() as conn:
+            if not conn.execute(_SQL_HAS_SYNC_TARGETS).fetchone()[0]:
+                return
+        token = self._get_api_token(api)
+        # /orders と /positions は互いに独立しているので、同時に問い合わせて待ち時間を重ねる
+        orders_future = self._api_executor.submit(self._fetch_orders_snapshot_with_token, api, token)
+        positions_future = self._api_executor.submit(self._fetch_positions_snapshot_with_token, api, token)
         try:
-            snapshots = self._fetch_orders_snapshot(api)
+            snapshots = orders_future.result()
         except Exception:
             return
         try:
-            positions = self._fetch_positions_snapshot(api)
+            positions = positions_future.result()
         except Exception:
             positions = []
 
-        by_id = {}
-        for order in snapshots:
-            oid = order.get("ID") or order.get("OrderId") or order.get("OrderID")
-            if oid:
-                by_id[str(oid)] = order
+        key = self._resolve_order_id_key(snapshots)
+        by_id = {str(oid): order for order in snapshots if (oid := order.get(key))} if key else {}
 
         def _sync(conn: sqlite3.Connection):
-            rows = conn.execute(
-                """
-                SELECT bi.id AS batch_item_id, bi.batch_job_id, bi.entry_order_id, bi.tp_order_id, bi.sl_order_id, bi.eod_order_id
-                FROM batch_items bi
-                JOIN batch_jobs bj ON bj.id = bi.batch_job_id
-                WHERE bj.status='RUNNING'
-                """
-            ).fetchall()
-
-            for row in rows:
-                item_id = int(row["batch_item_id"])
-                for role, key in (("entry", "entry_order_id"), ("tp", "tp_order_id"), ("sl", "sl_order_id"), ("eod", "eod_order_id")):
-                    oid = row[key]
+            now_jst = self._now_jst()
+            # 追跡中の全明細を毎周期なめるので、Row ではなくタプルで受けて展開する
+            cur = conn.cursor()
+            cur.row_factory = None
+            rows = cur.execute(_SQL_SYNC_TRACKED_ITEMS).fetchall()
+            # 同期で出るイベントは最後にまとめて書き込む
+            events: list[tuple[int, str, str, str]] = []
+            # 注文ID列はTEXT型なので、読み出した値はそのまま by_id のキーと突き合わせられる
+            find_api_order = by_id.get
+
+            for item_id, batch_job_id, entry_oid, tp_oid, sl_oid, eod_oid in rows:
+                for role, oid in (("entry", entry_oid), ("tp", tp_oid), ("sl", sl_oid), ("eod", eod_oid)):
                     if not oid:
                         continue
-                    api_order = by_id.get(str(oid))
+                    api_order = find_api_order(oid)
                     if not api_order:
                         continue
                     status = self._order_status_from_api(api_order)
                     cum_qty = int(api_order.get("CumQty") or 0)
                     avg_price = self._extract_order_avg_price(api_order)
                     conn.execute(
-                        """
-                        UPDATE orders
-                        SET status=?, cum_qty=?, avg_price=?, raw_json=?, last_sync_at=datetime('now','+9 hours'), updated_at=datetime('now','+9 hours')
-                        WHERE api_order_id=?
-                        """,
-                        (status, cum_qty, float(avg_price) if avg_price is not None else None, json.dumps(api_order, ensure_ascii=False), str(oid)),
+                        _SQL_SYNC_UPDATE_ORDER,
+                        (now_jst, now_jst, status, cum_qty, float(avg_price) if avg_price is not None else None, _json_dumps_text(api_order), oid),
                     )
                     if role == "entry":
                         new_status = "ENTRY_SENT"
@@ -1335,431 +2009,402 @@ class AppLogic(QObject):
                         elif status == "PARTIAL":
                             new_status = "ENTRY_PARTIAL"
                         if status == "FILLED" and not avg_price:
-                            self._log_event(
-                                int(row["batch_job_id"]),
+                            events.append((
+                                int(batch_job_id),
                                 "WARN",
                                 "ENTRY_PRICE_UNAVAILABLE",
                                 f"item={item_id} order_id={oid}",
-                                conn=conn,
-                            )
+                            ))
                         conn.execute(
-                            """
-                            UPDATE batch_items
-                            SET status=?, entry_filled_qty=?, entry_avg_price=?, updated_at=datetime('now','+9 hours')
-                            WHERE id=?
-                            """,
-                            (new_status, cum_qty, float(avg_price) if avg_price is not None else None, item_id),
+                            _SQL_SYNC_UPDATE_ENTRY,
+                            (now_jst, new_status, cum_qty, float(avg_price) if avg_price is not None else None, item_id),
                         )
 
+            if not positions:
+                self._log_events_bulk(conn, events)
+                return
+
+            # HoldID未割当の候補は1回のSELECTで取得し、(銘柄, 売買)で索引しておく
+            candidate_index: defaultdict[tuple[str, str], list[sqlite3.Row]] = defaultdict(list)
+            for candidate in conn.execute(_SQL_HOLD_ID_CANDIDATES).fetchall():
+                candidate_index[(candidate["symbol"], candidate["side"])].append(candidate)
+            hold_id_assignments: list[tuple[str, str, int]] = []
+
             for p in positions:
                 symbol = str(p.get("Symbol") or "").strip()
-                hold_id, hold_id_source = self._extract_position_hold_id(p)
+                hold_id, hold_id_source, is_valid_hold_id = self._extract_position_hold_id(p)
                 leaves_qty = self._parse_int(p.get("LeavesQty") or p.get("Qty"), 0)
-                position_side = self._kabu_side_to_internal(p.get("Side"))
+                position_side = _KABU_SIDE_TO_INTERNAL.get(str(p.get("Side") or "").strip())
                 if not symbol or not hold_id or leaves_qty <= 0:
                     continue
-                candidates = conn.execute(
-                    """
-                    SELECT bi.id, bi.side, bi.entry_filled_qty, bi.closed_qty, bi.batch_job_id
-                    FROM batch_items bi
-                    JOIN batch_jobs bj ON bj.id = bi.batch_job_id
-                    WHERE product='margin'
-                      AND symbol=?
-                      AND bi.status IN ('ENTRY_FILLED','BRACKET_SENT','ENTRY_PARTIAL')
-                      AND (bi.hold_id IS NULL OR bi.hold_id='')
-                      AND bj.status='RUNNING'
-                    ORDER BY bi.id ASC
-                    """,
-                    (symbol,),
-                ).fetchall()
+                candidates = [*candidate_index.get((symbol, "buy"), ()), *candidate_index.get((symbol, "sell"), ())]
                 if not candidates:
                     continue
 
-                if not self._is_valid_hold_id(hold_id):
+                if not is_valid_hold_id:
                     for candidate in candidates:
-                        self._log_event(
+                        events.append((
                             int(candidate["batch_job_id"]),
                             "WARN",
                             "INVALID_HOLD_ID",
                             f"symbol={symbol} hold_id={hold_id} source_positions={hold_id_source or '<unknown>'}",
-                            conn=conn,
-                        )
+                        ))
                     continue
 
-                matched = []
-                side_filtered = []
-                for candidate in candidates:
-                    if position_side and str(candidate["side"]) != position_side:
-                        continue
-                    side_filtered.append(candidate)
-                    remaining_qty = max(
-                        self._parse_int(candidate["entry_filled_qty"], 0) - self._parse_int(candidate["closed_qty"], 0),
-                        0,
-                    )
-                    if remaining_qty <= 0:
-                        continue
-                    if remaining_qty != leaves_qty:
-                        continue
-                    matched.append(candidate)
+                side_candidates = candidate_index.get((symbol, position_side), ()) if position_side else candidates
+                # 建玉の残数量に最も近い候補を先頭に並べる。先頭が採用候補で、差0が続く限り完全一致
+                nearest = sorted(
+                    ((abs(c["remaining_qty"] - leaves_qty), c["id"], c) for c in side_candidates if c["remaining_qty"] > 0),
+                    key=lambda entry: entry[:2],
+                )
+                target = nearest[0][2] if nearest else None
+                qty_diff = nearest[0][0] if nearest else None
+                matched = [c for diff, _, c in nearest if diff == 0]
 
-                if matched:
-                    target = matched[0]
-                else:
-                    nearest = None
-                    nearest_diff = None
-                    for candidate in side_filtered:
-                        remaining_qty = max(
-                            self._parse_int(candidate["entry_filled_qty"], 0) - self._parse_int(candidate["closed_qty"], 0),
-                            0,
+                if not matched:
+                    if target is None:
+                        not_found_message = f"symbol={symbol} hold_id={hold_id} source={hold_id_source or '<unknown>'} leaves_qty={leaves_qty} side={position_side or '<unknown>'}"
+                        not_found_error = f"HoldID紐付け不可: symbol={symbol} leaves_qty={leaves_qty}"
+                        events.extend(
+                            (candidate["batch_job_id"], "WARN", "HOLD_ID_MATCH_NOT_FOUND", not_found_message) for candidate in candidates
+                        )
+                        conn.executemany(
+                            _SQL_ITEM_SET_LAST_ERROR,
+                            [(now_jst, not_found_error, candidate["id"]) for candidate in candidates],
                         )
-                        if remaining_qty <= 0:
-                            continue
-                        diff = abs(remaining_qty - leaves_qty)
-                        if nearest is None or diff < nearest_diff or (diff == nearest_diff and int(candidate["id"]) < int(nearest["id"])):
-                            nearest = candidate
-                            nearest_diff = diff
-
-                    if nearest is None:
-                        for candidate in candidates:
-                            self._log_event(
-                                int(candidate["batch_job_id"]),
-                                "WARN",
-                                "HOLD_ID_MATCH_NOT_FOUND",
-                                f"symbol={symbol} hold_id={hold_id} source={hold_id_source or '<unknown>'} leaves_qty={leaves_qty} side={position_side or '<unknown>'}",
-                                conn=conn,
-                            )
-                            conn.execute(
-                                "UPDATE batch_items SET last_error=?, updated_at=datetime('now','+9 hours') WHERE id=?",
-                                (f"HoldID紐付け不可: symbol={symbol} leaves_qty={leaves_qty}", int(candidate["id"])),
-                            )
                         continue
 
-                    target = nearest
-                    self._log_event(
+                    events.append((
                         int(target["batch_job_id"]),
                         "WARN",
                         "HOLD_ID_MATCH_APPROX",
-                        f"symbol={symbol} hold_id={hold_id} source={hold_id_source or '<unknown>'} leaves_qty={leaves_qty} picked={target['id']} nearest_diff={nearest_diff}",
-                        conn=conn,
-                    )
-
-                conn.execute(
-                    "UPDATE batch_items SET last_error=NULL, updated_at=datetime('now','+9 hours') WHERE id=?",
-                    (int(target["id"]),),
-                )
+                        f"symbol={symbol} hold_id={hold_id} source={hold_id_source or '<unknown>'} leaves_qty={leaves_qty} picked={target['id']} nearest_diff={qty_diff}",
+                    ))
 
-                self._log_event(
+                events.append((
                     int(target["batch_job_id"]),
                     "DEBUG",
                     "HOLD_ID_ASSIGNED",
                     f"item={target['id']} symbol={symbol} hold_id={hold_id} source={hold_id_source or '<unknown>'} leaves_qty={leaves_qty}",
-                    conn=conn,
-                )
+                ))
 
-                conn.execute(
-                    """
-                    UPDATE batch_items
-                    SET hold_id=?, updated_at=datetime('now','+9 hours')
-                    WHERE id=?
-                    """,
-                    (hold_id, int(target["id"])),
-                )
+                hold_id_assignments.append((now_jst, hold_id, int(target["id"])))
+                # 割当済みの候補は以降の建玉の照合対象から外す
+                assigned = candidate_index[(symbol, target["side"])]
+                assigned[:] = [c for c in assigned if c["id"] != target["id"]]
 
                 if len(matched) > 1:
                     match_ids = ",".join(str(m["id"]) for m in matched)
-                    self._log_event(
+                    events.append((
                         int(target["batch_job_id"]),
                         "WARN",
                         "HOLD_ID_MULTI_CANDIDATE",
                         f"symbol={symbol} hold_id={hold_id} source={hold_id_source or '<unknown>'} leaves_qty={leaves_qty} candidates={len(matched)} ids=[{match_ids}] picked={target['id']} rule=earliest_id",
-                        conn=conn,
-                    )
+                    ))
                 if not matched:
                     continue
+            if hold_id_assignments:
+                conn.executemany(_SQL_ITEM_ASSIGN_HOLD_ID, hold_id_assignments)
+            self._log_events_bulk(conn, events)
         self._run_with_db_retry(_sync)
 
     def _oco_step(self):
         api = self._get_active_api_account()
         if not api:
             return
+        # ステップ全体で1本の接続を使い回し、HTTP呼び出しの前にはコミットして書き込みロックを手放す
+        now_jst = self._now_jst()
         with self._conn() as conn:
-            rows = conn.execute(
-                """
-                SELECT bi.*, bj.id AS batch_job_id
-                FROM batch_items bi
-                JOIN batch_jobs bj ON bj.id = bi.batch_job_id
-                WHERE bj.status='RUNNING'
-                  AND bi.status IN ('ENTRY_FILLED','ENTRY_FILLED_WAIT_PRICE')
-                  AND bi.tp_order_id IS NULL
-                  AND bi.sl_order_id IS NULL
-                """
-            ).fetchall()
+            rows = conn.execute(_SQL_OCO_TARGETS).fetchall()
 
-        for item in rows:
-            if item["product"] == "margin" and not item["hold_id"]:
-                hold_wait_message = "HoldID未取得のため利確/損切の発注を保留中"
-                with self._conn() as conn:
+            eligible: list[tuple[sqlite3.Row, int, float, float]] = []
+            skip_events: list[tuple[int, str, str, str]] = []
+            for item in rows:
+                if item["product"] == "margin" and not item["hold_id"]:
+                    hold_wait_message = "HoldID未取得のため利確/損切の発注を保留中"
                     if (item["last_error"] or "") != hold_wait_message:
                         conn.execute(
-                            "UPDATE batch_items SET last_error=?, updated_at=datetime('now','+9 hours') WHERE id=?",
-                            (hold_wait_message, item["id"]),
+                            _SQL_ITEM_SET_LAST_ERROR,
+                            (now_jst, hold_wait_message, item["id"]),
                         )
-                        self._log_event(
-                            int(item["batch_job_id"]),
+                        skip_events.append((
+                            item["batch_job_id"],
                             "WARN",
                             "OCO_WAIT_HOLD_ID",
                             f"item={item['id']} symbol={item['symbol']} side={item['side']}",
-                            conn=conn,
-                        )
-                continue
-            filled_qty = int(item["entry_filled_qty"] or 0)
-            closed_qty = int(item["closed_qty"] or 0)
-            qty = max(filled_qty - closed_qty, 0)
-            if qty <= 0:
-                with self._conn() as conn:
+                        ))
+                    continue
+                filled_qty = item["entry_filled_qty"]
+                closed_qty = item["closed_qty"]
+                qty = max(filled_qty - closed_qty, 0)
+                if qty <= 0:
                     conn.execute(
-                        "UPDATE batch_items SET status='CLOSED', updated_at=datetime('now','+9 hours') WHERE id=?",
-                        (item["id"],),
+                        _SQL_ITEM_SET_CLOSED,
+                        (now_jst, item["id"]),
                     )
-                    self._log_event(
-                        int(item["batch_job_id"]),
+                    skip_events.append((
+                        item["batch_job_id"],
                         "INFO",
                         "OCO_NO_REMAINING",
                         f"item={item['id']} filled={filled_qty} closed={closed_qty}",
-                        conn=conn,
-                    )
-                continue
-            avg = float(item["entry_avg_price"] or item["entry_price"] or 0)
-            if avg <= 0:
-                with self._conn() as conn:
+                    ))
+                    continue
+                avg = item["entry_avg_price"] or item["entry_price"] or 0.0
+                if avg <= 0:
                     conn.execute(
-                        "UPDATE batch_items SET status='ENTRY_FILLED_WAIT_PRICE', last_error=?, updated_at=datetime('now','+9 hours') WHERE id=?",
-                        ("約定価格の取得待ちのため利確/損切を保留中", item["id"]),
+                        _SQL_ITEM_WAIT_PRICE,
+                        (now_jst, "約定価格の取得待ちのため利確/損切を保留中", item["id"]),
                     )
-                    self._log_event(
-                        int(item["batch_job_id"]),
+                    skip_events.append((
+                        item["batch_job_id"],
                         "WARN",
                         "OCO_WAIT_PRICE",
                         f"item={item['id']}",
-                        conn=conn,
-                    )
-                continue
-            tp_abs = avg + float(item["tp_price"])
-            sl_abs = avg + float(item["sl_trigger_price"])
-            price_error = self._validate_oco_prices(str(item["side"]), avg, tp_abs, sl_abs)
-            if price_error:
-                with self._conn() as conn:
+                    ))
+                    continue
+                tp_abs = avg + item["tp_price"]
+                sl_abs = avg + item["sl_trigger_price"]
+                price_error = self._validate_oco_prices(item["side"], avg, tp_abs, sl_abs)
+                if price_error:
                     conn.execute(
-                        "UPDATE batch_items SET status='ERROR', last_error=?, updated_at=datetime('now','+9 hours') WHERE id=?",
-                        (price_error, item["id"]),
+                        _SQL_ITEM_SET_ERROR,
+                        (now_jst, price_error, item["id"]),
                     )
-                    self._log_event(
-                        int(item["batch_job_id"]),
+                    skip_events.append((
+                        item["batch_job_id"],
                         "ERROR",
                         "OCO_PRICE_INVALID",
                         f"item={item['id']} err={price_error}",
-                        conn=conn,
-                    )
-                continue
-            try:
-                tp_payload = self._build_exit_payload(item, "limit", qty, tp_abs, None, item["hold_id"])
-                with self._conn() as conn:
-                    self._log_payload_debug(int(item["batch_job_id"]), "TP_PAYLOAD", tp_payload, conn)
-                tp_order_id, tp_exchange = self._api_post_order(api, tp_payload)
-                sl_payload = self._build_exit_payload(item, "stop", qty, None, sl_abs, item["hold_id"])
-                with self._conn() as conn:
-                    self._log_payload_debug(int(item["batch_job_id"]), "SL_PAYLOAD", sl_payload, conn)
-                sl_order_id, sl_exchange = self._api_post_order(api, sl_payload)
-                if tp_exchange != sl_exchange:
-                    raise RuntimeError(f"TP/SLの市場コードが不一致です: tp={tp_exchange}, sl={sl_exchange}")
-            except Exception as e:
-                with self._conn() as conn:
-                    conn.execute(
-                        "UPDATE batch_items SET status='ERROR', last_error=?, updated_at=datetime('now','+9 hours') WHERE id=?",
-                        (str(e), item["id"]),
+                    ))
+                    continue
+                eligible.append((item, qty, tp_abs, sl_abs))
+            self._log_events_bulk(conn, skip_events)
+
+            conn.commit()
+            if eligible:
+                # 明細ごとの発注は互いに独立しているので、HTTP待ちを並行させてから結果をまとめて書き込む
+                token = self._get_api_token(api)
+                results = list(self._api_executor.map(lambda args: self._submit_oco(api, token, *args), eligible))
+
+                failed: list[tuple[str, str, int]] = []
+                sent: list[tuple[str, str, str, int, int]] = []
+                oco_events: list[tuple[int, str, str, str]] = []
+                for (item, qty, tp_abs, sl_abs), (tp_order_id, sl_order_id, tp_exchange, sl_exchange, err) in zip(eligible, results):
+                    if err is not None:
+                        failed.append((now_jst, str(err), item["id"]))
+                        oco_events.append((item["batch_job_id"], "ERROR", "OCO_FAILED", f"item={item['id']} err={err}"))
+                        continue
+                    sent.append((now_jst, tp_order_id, sl_order_id, tp_exchange, item["id"]))
+                    close_side = "sell" if item["side"] == "buy" else "buy"
+                    self._record_order(conn, item["id"], "tp", tp_order_id, close_side, qty, "limit", tp_abs, None, item["hold_id"])
+                    self._record_order(conn, item["id"], "sl", sl_order_id, close_side, qty, "stop", None, sl_abs, item["hold_id"])
+                    oco_events.append((
+                        item["batch_job_id"],
+                        "INFO",
+                        "OCO_SENT",
+                        f"item={item['id']} tp={tp_order_id} sl={sl_order_id} qty={qty} exchange_tp={tp_exchange} exchange_sl={sl_exchange}",
+                    ))
+                if failed:
+                    conn.executemany(
+                        _SQL_ITEM_SET_ERROR,
+                        failed,
                     )
-                    self._log_event(
-                        int(item["batch_job_id"]),
-                        "ERROR",
-                        "OCO_FAILED",
-                        f"item={item['id']} err={e}",
-                        conn=conn,
+                if sent:
+                    conn.executemany(
+                        """
+                        UPDATE batch_items
+                        SET updated_at=?, status='BRACKET_SENT', tp_order_id=?, sl_order_id=?, exchange=?
+                        WHERE id=?
+                        """,
+                        sent,
                     )
-                continue
+                self._log_events_bulk(conn, oco_events)
 
-            with self._conn() as conn:
-                conn.execute(
-                    """
-                    UPDATE batch_items
-                    SET status='BRACKET_SENT', tp_order_id=?, sl_order_id=?, exchange=?, updated_at=datetime('now','+9 hours')
-                    WHERE id=?
-                    """,
-                    (tp_order_id, sl_order_id, tp_exchange, item["id"]),
-                )
-                close_side = "sell" if item["side"] == "buy" else "buy"
-                self._record_order(conn, int(item["id"]), "tp", tp_order_id, close_side, qty, "limit", tp_abs, None, item["hold_id"])
-                self._record_order(conn, int(item["id"]), "sl", sl_order_id, close_side, qty, "stop", None, sl_abs, item["hold_id"])
-                self._log_event(
-                    int(item["batch_job_id"]),
-                    "INFO",
-                    "OCO_SENT",
-                    f"item={item['id']} tp={tp_order_id} sl={sl_order_id} qty={qty} exchange_tp={tp_exchange} exchange_sl={sl_exchange}",
-                    conn=conn,
+            conn.commit()
+            filled_rows = conn.execute(_SQL_OCO_FILLED_TARGETS).fetchall()
+            if not filled_rows:
+                return
+            # 反対側の取消が通った明細だけをCLOSEDにする。失敗した明細はBRACKET_SENTのまま次周期で再試行する
+            closed: list[tuple[str, int, int]] = []
+            events: list[tuple[int, str, str, str]] = []
+            cancel_error: Optional[Exception] = None
+            cancel_results = self._cancel_orders_bulk(api, [row["cancel_order_id"] for row in filled_rows])
+            for row, (_, ok, err) in zip(filled_rows, cancel_results):
+                if not ok:
+                    cancel_error = cancel_error or err
+                    continue
+                closed.append((now_jst, row["filled_qty"], row["id"]))
+                events.append((row["batch_job_id"], "INFO", row["event_type"], f"item={row['id']}"))
+            if closed:
+                conn.executemany(
+                    _SQL_ITEM_CLOSE_BRACKET,
+                    closed,
                 )
+            self._log_events_bulk(conn, events)
+            conn.commit()
+            if cancel_error is not None:
+                raise cancel_error
 
-        with self._conn() as conn:
-            close_rows = conn.execute(
-                """
-                SELECT bi.id, bi.batch_job_id, bi.tp_order_id, bi.sl_order_id,
-                       otp.status AS tp_status, otp.cum_qty AS tp_cum,
-                       osl.status AS sl_status, osl.cum_qty AS sl_cum
-                FROM batch_items bi
-                JOIN batch_jobs bj ON bj.id=bi.batch_job_id
-                LEFT JOIN orders otp ON otp.api_order_id = bi.tp_order_id
-                LEFT JOIN orders osl ON osl.api_order_id = bi.sl_order_id
-                WHERE bj.status='RUNNING' AND bi.status='BRACKET_SENT'
-                """
-            ).fetchall()
+    def _submit_oco(
+        self,
+        api: ApiAccount,
+        token: Optional[str],
+        item: sqlite3.Row,
+        qty: int,
+        tp_abs: float,
+        sl_abs: float,
+    ) -> tuple[Optional[str], Optional[str], Optional[int], Optional[int], Optional[Exception]]:
+        # ワーカースレッドから呼ばれるため、DBには触れずに発注結果だけを返す
+        try:
+            tp_payload = self._build_exit_payload(item, "limit", qty, tp_abs, None, item["hold_id"])
+            sl_payload = self._build_exit_payload(item, "stop", qty, None, sl_abs, item["hold_id"])
+            self._log_payload_debug(item["batch_job_id"], "TP_PAYLOAD", tp_payload)
+            tp_order_id, tp_exchange = self._api_post_order_with_token(api, token, tp_payload)
+            self._log_payload_debug(item["batch_job_id"], "SL_PAYLOAD", sl_payload)
+            sl_order_id, sl_exchange = self._api_post_order_with_token(api, token, sl_payload)
+            if tp_exchange != sl_exchange:
+                raise RuntimeError(f"TP/SLの市場コードが不一致です: tp={tp_exchange}, sl={sl_exchange}")
+        except Exception as e:
+            return None, None, None, None, e
+        return tp_order_id, sl_order_id, tp_exchange, sl_exchange, None
+
+    def _cancel_orders_bulk(
+        self, api: ApiAccount, order_ids: list[Optional[str]]
+    ) -> list[tuple[Optional[str], bool, Optional[Exception]]]:
+        # 取消同士は依存関係がないので並行して投げる。kabuステーションには一括取消APIがない
+        def cancel(order_id: Optional[str]) -> tuple[Optional[str], bool, Optional[Exception]]:
+            try:
+                self._cancel_order_if_needed(api, order_id)
+            except Exception as e:
+                return order_id, False, e
+            return order_id, True, None
+
+        if len(order_ids) <= 1:
+            return [cancel(order_id) for order_id in order_ids]
+        return list(self._api_executor.map(cancel, order_ids))
 
-        for row in close_rows:
-            item_id = int(row["id"])
-            if row["tp_status"] == "FILLED":
-                self._cancel_order_if_needed(api, row["sl_order_id"])
-                with self._conn() as conn:
-                    conn.execute(
-                        "UPDATE batch_items SET status='CLOSED', closed_qty=?, updated_at=datetime('now','+9 hours') WHERE id=?",
-                        (int(row["tp_cum"] or 0), item_id),
-                    )
-                    self._log_event(int(row["batch_job_id"]), "INFO", "TP_FILLED", f"item={item_id}", conn=conn)
-            elif row["sl_status"] == "FILLED":
-                self._cancel_order_if_needed(api, row["tp_order_id"])
-                with self._conn() as conn:
-                    conn.execute(
-                        "UPDATE batch_items SET status='CLOSED', closed_qty=?, updated_at=datetime('now','+9 hours') WHERE id=?",
-                        (int(row["sl_cum"] or 0), item_id),
-                    )
-                    self._log_event(int(row["batch_job_id"]), "INFO", "SL_FILLED", f"item={item_id}", conn=conn)
     def _cancel_order_if_needed(self, api: ApiAccount, api_order_id: Optional[str]) -> None:
         if not api_order_id:
             return
+        # 取消の成否で明細をCLOSEDにするか決めるので、送れなかった場合も失敗として呼び出し元へ返す
         token = self._get_api_token(api)
         if not token:
-            return
-        base_url = self._normalize_base_url(api.base_url)
+            raise RuntimeError(self._build_last_token_error_message("APIトークン取得に失敗"))
+        base_url = api.normalized_base_url
         try:
             self._request_json("PUT", f"{base_url}/cancelorder", headers={"X-API-KEY": token}, payload={"OrderID": api_order_id})
         except urllib.error.HTTPError as e:
             raise RuntimeError(self._build_http_error_with_body("取消API呼び出しに失敗", e)) from e
-        except Exception:
-            return
+        except Exception as e:
+            raise RuntimeError(self._build_api_error_message("取消API呼び出しに失敗", e)) from e
 
     def _eod_step(self):
-        now = datetime.now()
-        if now.strftime("%H:%M") < "14:30":
+        if datetime.now().time() < _EOD_CUTOFF:
             return
         api = self._get_active_api_account()
         if not api:
             return
+        # ステップ全体で1本の接続を使い回し、HTTP呼び出しの前にはコミットして書き込みロックを手放す
+        now_jst = self._now_jst()
         with self._conn() as conn:
-            rows = conn.execute(
-                """
-                SELECT bi.*, bj.id AS batch_job_id, bj.eod_force_close
-                FROM batch_items bi
-                JOIN batch_jobs bj ON bj.id=bi.batch_job_id
-                WHERE bj.status='RUNNING'
-                  AND bj.eod_force_close=1
-                  AND bi.status IN ('ENTRY_PARTIAL','ENTRY_FILLED','BRACKET_SENT')
-                """
-            ).fetchall()
-
-        for item in rows:
-            try:
-                self._cancel_order_if_needed(api, item["tp_order_id"])
-                self._cancel_order_if_needed(api, item["sl_order_id"])
-                remaining = max(int(item["entry_filled_qty"] or 0) - int(item["closed_qty"] or 0), 0)
-                if remaining <= 0:
-                    with self._conn() as conn:
-                        conn.execute("UPDATE batch_items SET status='CLOSED', updated_at=datetime('now','+9 hours') WHERE id=?", (item["id"],))
+            # EOD成行が約定済みの明細は同じトランザクションでまとめてCLOSEDにする
+            empty_rows = conn.execute(_SQL_EOD_EMPTY_TARGETS).fetchall()
+            done_rows = conn.execute(_SQL_EOD_CLOSE_FILLED).fetchall()
+            self._log_events_bulk(
+                conn,
+                [(row["batch_job_id"], "INFO", "EOD_FILLED", f"item={row['id']}") for row in done_rows],
+            )
+            rows = conn.execute(_SQL_EOD_TARGETS).fetchall()
+            conn.commit()
+            # 全明細のTP/SL取消を先にまとめて並行実行し、明細ごとの最初のエラーだけ控えておく
+            cancel_targets = [
+                (row["id"], order_id)
+                for row in (*empty_rows, *rows)
+                for order_id in (row["tp_order_id"], row["sl_order_id"])
+                if order_id
+            ]
+            cancel_results = self._cancel_orders_bulk(api, [order_id for _, order_id in cancel_targets])
+            cancel_errors: dict[int, Exception] = {}
+            for (item_id, _), (_, ok, err) in zip(cancel_targets, cancel_results):
+                if not ok:
+                    cancel_errors.setdefault(item_id, err)
+            # 残数量のない明細は、取消が全て通ったものだけCLOSEDにし、失敗したものはERRORにする
+            emptied: list[tuple[str, int]] = []
+            empty_failed: list[tuple[str, str, int]] = []
+            empty_events: list[tuple[int, str, str, str]] = []
+            for row in empty_rows:
+                err = cancel_errors.get(row["id"])
+                if err is None:
+                    emptied.append((now_jst, row["id"]))
                     continue
-                if item["product"] == "margin" and not item["hold_id"]:
-                    with self._conn() as conn:
+                empty_failed.append((now_jst, str(err), row["id"]))
+                empty_events.append((row["batch_job_id"], "ERROR", "EOD_FAILED", f"item={row['id']} err={err}"))
+            if emptied:
+                conn.executemany(_SQL_ITEM_SET_CLOSED, emptied)
+            if empty_failed:
+                conn.executemany(_SQL_ITEM_SET_ERROR, empty_failed)
+            self._log_events_bulk(conn, empty_events)
+
+            for item in rows:
+                try:
+                    conn.commit()
+                    if item["id"] in cancel_errors:
+                        raise cancel_errors[item["id"]]
+                    remaining = item["entry_filled_qty"] - item["closed_qty"]
+                    if item["product"] == "margin" and not item["hold_id"]:
                         msg = "EOD時点でHoldID未取得のため決済不可"
                         conn.execute(
-                            "UPDATE batch_items SET last_error=?, updated_at=datetime('now','+9 hours') WHERE id=?",
-                            (msg, item["id"]),
+                            _SQL_ITEM_SET_LAST_ERROR,
+                            (now_jst, msg, item["id"]),
                         )
                         self._log_event(
-                            int(item["batch_job_id"]),
+                            item["batch_job_id"],
                             "ERROR",
                             "EOD_HOLD_ID_MISSING",
                             f"item={item['id']} symbol={item['symbol']} side={item['side']} remaining={remaining}",
                             conn=conn,
                         )
-                    continue
-                payload = self._build_exit_payload(item, "market", remaining, None, None, item["hold_id"])
-                with self._conn() as conn:
-                    self._log_payload_debug(int(item["batch_job_id"]), "EOD_PAYLOAD", payload, conn)
-                eod_order_id, _ = self._api_post_order(api, payload)
-            except Exception as e:
-                with self._conn() as conn:
-                    conn.execute("UPDATE batch_items SET status='ERROR', last_error=?, updated_at=datetime('now','+9 hours') WHERE id=?", (str(e), item["id"]))
+                        continue
+                    payload = self._build_exit_payload(item, "market", remaining, None, None, item["hold_id"])
+                    self._log_payload_debug(item["batch_job_id"], "EOD_PAYLOAD", payload)
+                    eod_order_id, _ = self._api_post_order(api, payload)
+                except Exception as e:
+                    conn.execute(_SQL_ITEM_SET_ERROR, (now_jst, str(e), item["id"]))
                     self._log_event(
-                        int(item["batch_job_id"]),
+                        item["batch_job_id"],
                         "ERROR",
                         "EOD_FAILED",
                         f"item={item['id']} err={e}",
                         conn=conn,
                     )
-                continue
+                    continue
 
-            with self._conn() as conn:
                 close_side = "sell" if item["side"] == "buy" else "buy"
-                self._record_order(conn, int(item["id"]), "eod", eod_order_id, close_side, remaining, "market", None, None, item["hold_id"])
-                conn.execute(
-                    """
-                    UPDATE batch_items
-                    SET eod_order_id=?, status='EOD_MARKET_SENT', updated_at=datetime('now','+9 hours')
-                    WHERE id=?
-                    """,
-                    (eod_order_id, item["id"]),
-                )
+                self._record_order(conn, item["id"], "eod", eod_order_id, close_side, remaining, "market", None, None, item["hold_id"])
+                conn.execute(_SQL_ITEM_EOD_SENT, (now_jst, eod_order_id, item["id"]))
                 self._log_event(
-                    int(item["batch_job_id"]),
+                    item["batch_job_id"],
                     "WARN",
                     "EOD_FORCE_CLOSE",
                     f"item={item['id']} eod_order_id={eod_order_id}",
                     conn=conn,
                 )
 
-        with self._conn() as conn:
-            done_rows = conn.execute(
-                """
-                SELECT bi.id, bi.batch_job_id, bi.eod_order_id, oeod.status
-                FROM batch_items bi
-                LEFT JOIN orders oeod ON oeod.api_order_id = bi.eod_order_id
-                WHERE bi.status='EOD_MARKET_SENT'
-                """
-            ).fetchall()
-            for row in done_rows:
-                if row["status"] == "FILLED":
-                    conn.execute("UPDATE batch_items SET status='CLOSED', updated_at=datetime('now','+9 hours') WHERE id=?", (row["id"],))
-                    self._log_event(int(row["batch_job_id"]), "INFO", "EOD_FILLED", f"item={row['id']}", conn=conn)
-
     def _finalize_jobs_step(self):
         with self._conn() as conn:
-            jobs = conn.execute("SELECT id FROM batch_jobs WHERE status='RUNNING'").fetchall()
-            for job in jobs:
-                counts = conn.execute(
-                    "SELECT status, COUNT(*) AS c FROM batch_items WHERE batch_job_id=? GROUP BY status",
-                    (job["id"],),
-                ).fetchall()
-                by_status = {row["status"]: int(row["c"]) for row in counts}
-                total = sum(by_status.values())
-                closed = by_status.get("CLOSED", 0)
-                errors = by_status.get("ERROR", 0)
-                if total > 0 and closed == total:
-                    conn.execute("UPDATE batch_jobs SET status='DONE', updated_at=datetime('now','+9 hours') WHERE id=?", (job["id"],))
-                    self._log_event(int(job["id"]), "INFO", "BATCH_DONE", "全銘柄が決済完了", conn=conn)
+            now_jst = self._now_jst()
+            done: list[tuple[str, int]] = []
+            failed: list[tuple[str, int]] = []
+            events: list[tuple[int, str, str, str]] = []
+            for job_id, total, closed, errors in conn.execute(_SQL_RUNNING_JOB_ITEM_COUNTS):
+                if closed == total:
+                    done.append((now_jst, job_id))
+                    events.append((job_id, "INFO", "BATCH_DONE", "全銘柄が決済完了"))
                 elif errors > 0:
-                    conn.execute("UPDATE batch_jobs SET status='ERROR', updated_at=datetime('now','+9 hours') WHERE id=?", (job["id"],))
-                    self._log_event(int(job["id"]), "ERROR", "BATCH_ERROR", f"error_items={errors}", conn=conn)
+                    failed.append((now_jst, job_id))
+                    events.append((job_id, "ERROR", "BATCH_ERROR", f"error_items={errors}"))
+            if done:
+                conn.executemany(_SQL_JOB_SET_DONE, done)
+            if failed:
+                conn.executemany(_SQL_JOB_SET_ERROR, failed)
+            self._log_events_bulk(conn, events)
@@ -202,7 +202,7 @@ class TradeOrderPage(QWidget):
 
             entry_price = None
             if entry_type == "limit":
-                entry_price = int(row_widget.limit_price_input.value())
+                entry_price = float(row_widget.limit_price_input.value())
 
             orders.append({
                 "symbol": symbol,
@@ -228,24 +228,24 @@ class TradeOrderPage(QWidget):
             errors.append("注文行を追加してください。")
             return errors
 
-        for index, row_widget in enumerate(self._iter_order_row_widgets()):
+        for row_no, row_widget in enumerate(self._iter_order_row_widgets(), 1):
             symbol = row_widget.symbol_input.text().strip()
             if not symbol:
-                errors.append(f"{index + 1}行目: 銘柄コードを入力してください。")
+                errors.append(f"{row_no}行目: 銘柄コードを入力してください。")
                 continue
 
             entry_type = row_widget.entry_type_input.currentData()
             if entry_type == "limit" and row_widget.limit_price_input.value() < 1:
-                errors.append(f"{index + 1}行目: 指値価格は1円以上で指定してください。")
+                errors.append(f"{row_no}行目: 指値価格は1円以上で指定してください。")
 
             if row_widget.sl_diff_input.value() < 1:
-                errors.append(f"{index + 1}行目: 損切差額は1円以上で指定してください。")
+                errors.append(f"{row_no}行目: 損切差額は1円以上で指定してください。")
 
             if row_widget.tp_diff_input.value() < 1:
-                errors.append(f"{index + 1}行目: 利確差額は1円以上で指定してください。")
+                errors.append(f"{row_no}行目: 利確差額は1円以上で指定してください。")
 
             if row_widget.qty_input.value() < 1:
-                errors.append(f"{index + 1}行目: 数量は1以上で指定してください。")
+                errors.append(f"{row_no}行目: 数量は1以上で指定してください。")
         return errors
 
     def _validate_order_form(self):